@@ -5,113 +5,355 @@ equivalent CO2 (eCO2) and Total Volatile Organic Compound (TVOC) and displays
 the values on a 2.9in Waveshare e-Paper display.
 """
 import machine
-import esp32
 import utime
 import ccs811
+import i2c_bus
 import bme280
-import screen
 import battery
-import baseline
 import config
+import reading_log
+import refresh
+import rollup
+import screen_texts
+import state
+import trend
 
-_i2c = machine.I2C(scl=config.scl, sda=config.sda, freq=100000)
-_rtc = machine.RTC()
-_bat = battery.Battery(config.battery)
-_baseline = baseline.Baseline()
+_BASELINE_LOADED = 0x01
+_CCS811_VALIDATED = 0x02
+_CCS811_ON_BAND = 0x04  # nINT asserted only on eCO2 band changes
+_SHOWN_SIZE = 64
+_TREND_COLUMNS = 144  # width of the screen.Screen graph
+
+# Kept in RTC memory during deep sleep, change the version with the fields
+_state = state.State(machine.RTC(), 4)
+_state.add('runs', 'B')  # to condition the ccs811
+_state.add('flags', 'B')
+_state.add('epd', 'B')  # display controller state
+_state.add('refresh', '%ds' % refresh.Refresh.STATE_SIZE)
+_state.add('bme280', '%ds' % bme280.BME280.CALIBRATION_SIZE)
+_state.add('battery', '%ds' % battery.Battery.STATE_SIZE)
+# shown screen texts, length then the texts separated by '\x00'
+_state.add('shown', '%ds' % _SHOWN_SIZE)
+_state.add('log', '%ds' % reading_log.ReadingLog.state_size(config.log_batch))
+_state.add('rollup', '%ds' % rollup.Rollup.state_size(config.rollup_periods))
+_state.add('trend', '%ds' % trend.Trend.state_size(_TREND_COLUMNS))
 
 
 def run():
     """Main entry point to execute this program."""
+    # Wake ccs811, datasheet figure 4
+    machine.Pin(config.wake, machine.Pin.OUT, value=0)
+    i2c = i2c_bus.I2CBus(machine.Pin(config.scl), machine.Pin(config.sda))
+    wake_on_band = False
+    _state.load()
     try:
-        bme = bme280.BME280(i2c=_i2c, mode=bme280.BME280_OSAMPLE_4)
-        scr = screen.Screen(config)
+        first_run = _is_first_run()
+        bme = _start_bme280(i2c, first_run)
 
         if _delete_ccs811_baseline_requested():
-            _baseline.delete()
+            _baseline().delete()
 
-        if _is_first_run():
+        if first_run:
             # 20 runs (minutes), p9 of datasheet
             _set_runs_to_condition(20)
-            ccs = ccs811.CCS811(_i2c, mode=ccs811.CCS811.DRIVE_MODE_60SEC)
+            ccs = ccs811.CCS811(i2c, mode=ccs811.CCS811.DRIVE_MODE_60SEC)
+            _set_flag(_CCS811_VALIDATED)
             t, p, h = bme.read_data()
+            volts = _volts()
             # Full update of Waveshare on power on
-            scr.update(t, h, None, None, _bat.volts(), False, True)
+            _update_screen(t, h, None, None, volts, False, True)
+            _log_reading(t, h, None, None, volts, reading_log.FLAG_POWER_ON)
         else:
-            ccs = ccs811.CCS811(_i2c, mode=None)
+            ccs, result = _start_ccs811(i2c)
             _add_run()
-            ccs.read()
+            # Every minute while conditioning, then only on band changes
+            wake_on_band = config.co2_wake_on_band and \
+                _ccs811_is_conditioned()
+            if wake_on_band != _flag(_CCS811_ON_BAND):
+                _set_ccs811_interrupt(ccs, wake_on_band)
+            if result.error:
+                print('ccs811 error 0x%02x' % result.error_id)
             t, p, h = bme.read_data()
             ccs.put_envdata(t, h)
+            volts = _volts()
+            co2 = voc = None
 
             if _ccs811_is_conditioned():
                 # Stored baseline should only be loaded after conditioning
-                if not _ccs811_baseline_is_loaded() and _baseline.exists():
-                    baseline = _baseline.retrieve()
+                if not _ccs811_baseline_is_loaded() and \
+                        _baseline().exists():
+                    baseline = _baseline().retrieve()
                     ccs.put_baseline(baseline)
                     _set_ccs811_baseline_loaded()
-                    scr.update(t, h, None, None, _bat.volts())
+                    _update_screen(t, h, None, None, volts)
                     print('ccs811 baseline %d loaded' % baseline)
                 else:
-                    scr.update(t, h, ccs.eco2, ccs.tvoc, _bat.volts(),
-                               _ccs811_baseline_is_loaded())
+                    co2 = ccs.eco2
+                    voc = ccs.tvoc
+                    _update_screen(t, h, co2, voc, volts,
+                                   _ccs811_baseline_is_loaded())
                 if _new_ccs811_baseline_requested():
                     baseline = ccs.get_baseline()
-                    _baseline.store(baseline)
+                    _baseline().store(baseline)
                     print('ccs811 baseline %d stored' % baseline)
             else:
-                scr.update(t, h, None, None, _bat.volts())
+                _update_screen(t, h, None, None, volts)
+            _log_reading(t, h, co2, voc, volts,
+                         reading_log.FLAG_BASELINE
+                         if _ccs811_baseline_is_loaded() else 0)
 
             print('eCO2: %dppm, TVOC: %dppb, %.1fC, %.1f%%RH, baseline: %r' %
                   (ccs.eco2, ccs.tvoc, t, h, _ccs811_baseline_is_loaded()))
 
-        scr.sleep()
         _flash_led()
     except Exception as e:
         _flash_led(3)
         print(e)
+    for device in i2c.devices:
+        print('i2c: 0x%02x %d transactions %d bytes %d retries at %dkHz' %
+              (device.address, device.transactions, device.bytes,
+               device.retries, device.freq // 1000))
+
+    _state.save()
+    import esp32
+    esp32.wake_on_ext0(pin=machine.Pin(config.int, machine.Pin.IN,
+                                       machine.Pin.PULL_UP), level=0)
+    if wake_on_band:
+        machine.deepsleep(config.timer_wake_ms)
+    else:
+        machine.deepsleep()
+
+
+def _start_bme280(i2c, first_run):
+    # The calibration is only read from the bme280 if it is not in RTC
+    # memory, or no longer matches the sensor. The profile is set on the
+    # first run, the bme280 keeps it while the esp32 is in deep sleep.
+    cached = _state['bme280']
+    bme = bme280.BME280(i2c=i2c, profile=config.bme280_profile,
+                        calibration=cached,
+                        compensation=bme280.BME280_COMPENSATION_INT32,
+                        configured=not first_run)
+    _state['bme280'] = bme.calibration
+    return bme
+
+
+def _start_ccs811(i2c):
+    # The ccs811 was validated and its application started before deep
+    # sleep. It is only validated and started again if it does not respond,
+    # or its status shows it was reset into boot mode.
+    validated = _flag(_CCS811_VALIDATED)
+    start = utime.ticks_us()
+    result = None
+    if validated:
+        try:
+            ccs = ccs811.CCS811(i2c, mode=None, validated=True)
+            result = ccs.read_result()
+        except OSError:
+            pass
+    if result is None or not result.app_running:
+        validated = False
+        ccs = ccs811.CCS811(i2c, mode=ccs811.CCS811.DRIVE_MODE_60SEC)
+        result = ccs.read_result()
+        # Started as on power on, without the baseline or band interrupts
+        _clear_flag(_BASELINE_LOADED | _CCS811_ON_BAND)
+    print('ccs811: %s start and read %dus' %
+          ('warm' if validated else 'cold',
+           utime.ticks_diff(utime.ticks_us(), start)))
+    _set_flag(_CCS811_VALIDATED)
+    return ccs, result
+
+
+def _set_ccs811_interrupt(ccs, on_band):
+    # The ccs811 keeps its mode during deep sleep, so it is only set when
+    # it differs from what the config wants
+    if on_band:
+        ccs.set_thresholds(config.co2_bands[0], config.co2_bands[1],
+                           config.co2_hysteresis)
+        ccs.set_mode(ccs811.CCS811.DRIVE_MODE_60SEC, True)
+        _set_flag(_CCS811_ON_BAND)
+    else:
+        ccs.set_mode(ccs811.CCS811.DRIVE_MODE_60SEC)
+        _clear_flag(_CCS811_ON_BAND)
+
+
+def _update_screen(temperature, humidity, co2, voc, voltage,
+                   baseline=False, fullupdate=False):
+    # The display is only imported and woken when what it shows would
+    # change, or a full refresh is due to clear ghosting
+    now = utime.localtime()
+    scheduler = _refresh_scheduler()
+    fullupdate = fullupdate or scheduler.full_refresh_due(now)
+    texts = screen_texts.texts(temperature, humidity, co2, voc, voltage,
+                               baseline)
+    graph = _trend(co2)
+    if not fullupdate and texts == _shown() and \
+            not (graph and graph.changed()):
+        print('display: unchanged')
+        return
 
-    esp32.wake_on_ext0(pin=config.int, level=0)
-    machine.deepsleep()
+    import screen
+    epd_state = _state['epd']
+    # Not known until the display is asleep again
+    _state['epd'] = 0
+    scr = screen.Screen(config, _shown(), epd_state)
+    scr.update(temperature, humidity, co2, voc, voltage, baseline,
+               fullupdate, graph)
+    scr.sleep()
+    if fullupdate:
+        _battery_loaded()
+    scheduler.updated(fullupdate, scr.changed_pixels, now)
+    _state['epd'] = scr.epd_state
+    _state['refresh'] = scheduler.state
+    if graph is not None:
+        _state['trend'] = graph.state
+    _set_shown(scr.shown)
+    print('display: %d bytes sent in %d transactions' %
+          (scr.bytes_sent, scr.transactions))
+    for command, ms in scr.busy_ms.items():
+        print('display: busy %dms after %s' %
+              (ms, 'reset' if command is None else '0x%02x' % command))
+    print('display: %s refresh, %d partial updates changing %d pixels '
+          'since full refresh' % ('full' if fullupdate else 'partial',
+                                  scheduler.partial_count,
+                                  scheduler.changed_pixels))
+
+
+def _trend(co2):
+    # eCO2 trend graph with the reading added, None if it is not shown
+    if not config.trend:
+        return None
+    graph = trend.Trend(_TREND_COLUMNS, config.trend_period,
+                        config.trend_range[0], config.trend_range[1],
+                        _state['trend'])
+    if co2 is not None:
+        graph.add(utime.time(), co2)
+        _state['trend'] = graph.state
+    return graph
+
+
+def _refresh_scheduler():
+    return refresh.Refresh(config.refresh_max_partial,
+                           config.refresh_max_pixels,
+                           config.refresh_quiet_hour, _state['refresh'])
 
 
 def _set_runs_to_condition(run_count):
     """Set number of runs (minutes) required to condition ccs811 sensor."""
-    _rtc.memory(bytes([run_count]))
+    _state['runs'] = run_count
 
 
 def _is_first_run():
-    memory = _rtc.memory()
-    return len(memory) == 0
+    # No state is kept on power on
+    return not _state.loaded
 
 
 def _ccs811_is_conditioned():
-    memory = _rtc.memory()
-    return memory[0] == 0
+    return _state['runs'] == 0
 
 
 def _ccs811_baseline_is_loaded():
-    memory = _rtc.memory()
-    return len(memory) > 1 and memory[1] == 1
+    return _flag(_BASELINE_LOADED)
 
 
 def _set_ccs811_baseline_loaded():
-    memory = _rtc.memory()
-    _rtc.memory(bytes([memory[0], 1]))
+    _set_flag(_BASELINE_LOADED)
+
+
+def _flag(flag):
+    return _state['flags'] & flag != 0
+
+
+def _set_flag(flag):
+    _state['flags'] |= flag
+
+
+def _clear_flag(flag):
+    _state['flags'] &= ~flag
+
+
+def _shown():
+    # Texts shown on the screen before deep sleep, None if not known
+    data = _state['shown']
+    if data[0] == 0:
+        return None
+    return tuple(data[1:1 + data[0]].decode().split('\x00'))
+
+
+def _set_shown(shown):
+    data = '\x00'.join(shown).encode()
+    if len(data) >= _SHOWN_SIZE:
+        data = b''
+    _state['shown'] = bytes([len(data)]) + data
 
 
 def _new_ccs811_baseline_requested():
-    return config.sw1.value() == 0
+    return _switch_pressed(config.sw1)
 
 
 def _delete_ccs811_baseline_requested():
-    return config.sw2.value() == 0
+    return _switch_pressed(config.sw2)
+
+
+def _switch_pressed(pin):
+    # Switches pull down the pin
+    return machine.Pin(pin, machine.Pin.IN, machine.Pin.PULL_UP).value() == 0
+
+
+def _battery():
+    return battery.Battery(config.battery, config.battery_interval,
+                           _state['battery'])
+
+
+def _volts():
+    # Measured every battery_interval wakes, or after a full refresh
+    cell = _battery()
+    volts = cell.volts()
+    _state['battery'] = cell.state
+    return volts
+
+
+def _battery_loaded():
+    cell = _battery()
+    cell.loaded()
+    _state['battery'] = cell.state
+
+
+def _log_reading(temperature, humidity, co2, voc, volts, flags):
+    # Kept in RTC memory, written to flash every log_batch wakes, and
+    # summarised in the rollup
+    timestamp = utime.time()
+    log = reading_log.ReadingLog(config.log_directory, config.log_batch,
+                                 config.log_segments,
+                                 config.log_segment_records, _state['log'])
+    try:
+        written = log.append(timestamp, temperature, humidity, co2, voc,
+                             volts, flags)
+    finally:
+        _state['log'] = log.state
+    if written:
+        print('log: %d readings written' % written)
+    history = rollup.Rollup(config.rollup_directory, config.rollup_periods,
+                            _state['rollup'])
+    try:
+        history.add(timestamp, temperature, humidity, co2, voc, volts)
+    except OSError as e:
+        # Derived from the log, so a failure is not allowed to stop it
+        print('rollup: %s' % e)
+    finally:
+        _state['rollup'] = history.state
+
+
+def _baseline():
+    # Modules and pins needed only by some wakes are created when needed,
+    # this only when the baseline is loaded, stored or deleted
+    import baseline
+    return baseline.Baseline()
 
 
 def _add_run():
     # Decrement run count in first 20mins of running
-    memory = _rtc.memory()
-    if memory[0] != 0:
-        _rtc.memory(bytes([memory[0] - 1]))
+    if _state['runs'] != 0:
+        _state['runs'] -= 1
 
 
 def _flash_led(count=1):
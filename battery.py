@@ -1,25 +1,104 @@
 """Reads the battery voltage of the Lolin D32 development board."""
-from machine import ADC
+import ustruct
 
 
 class Battery:
-    """Reads the battery voltage of the Lolin D32 development board."""
+    """Reads the battery voltage of the Lolin D32 development board.
+
+    The voltage changes over hours, so a measurement is kept smoothed as
+    bytes that can be held in RTC memory during deep sleep, and the ADC is
+    only read again after a number of wakes or a load on the battery.
+    """
+
+    STATE_SIZE = 4
+    _STATE = '<HBB'
 
     # See Lolin D32 schematic 'Battery' section
     _RESISTOR_RATIO = (100000 + 100000) / 100000
     _REFERENCE_VOLTAGE = 3.296  # measured for individual Lolin D32
-    _ADC_READS = 100
+    # Battery mV at the ADC full scale, for the linearized reading
+    _FULL_SCALE_MV = int(_RESISTOR_RATIO * _REFERENCE_VOLTAGE * 1000 + 0.5)
+
+    # ADC reads in batches until the mean of a batch is within _TOLERANCE
+    # counts of the mean before it, after at least _MIN_READS
+    _BATCH = 8
+    _MIN_READS = 16
+    _MAX_READS = 96
+    _TOLERANCE = 2
+
+    # Linear counts at every 256 counts of the esp32 ADC with 11dB
+    # attenuation, from its typical response, equal around 3.7V battery
+    # (2304) where _REFERENCE_VOLTAGE was measured
+    _LINEAR = (0, 87, 372, 658, 942, 1224, 1503, 1776, 2044, 2304, 2555,
+               2797, 3027, 3245, 3449, 3638, 3809)
+
+    # New measurements move the smoothed voltage by 1 / (1 << _SMOOTHING)
+    _SMOOTHING = 2
+    _LOADED = 0x01
 
-    def __init__(self, adcpin):
-        """Create with the supplied adc pin."""
+    def __init__(self, adcpin, interval=1, state=None):
+        """Create with the adc pin number.
+
+        interval is the number of wakes a measurement is used for, state
+        is bytes from the state property of a previous wake, None if not
+        known.
+        """
         self._pin = adcpin
+        self._interval = interval
+        self._millivolts = 0
+        self._wakes = 0
+        self._flags = 0
+        if state is not None and len(state) == self.STATE_SIZE:
+            self._millivolts, self._wakes, self._flags = \
+                ustruct.unpack(self._STATE, state)
+
+    @property
+    def state(self):
+        """State to pass to the next Battery, as bytes."""
+        return ustruct.pack(self._STATE, self._millivolts, self._wakes,
+                            self._flags)
+
+    def loaded(self):
+        """Record a load on the battery, the next volts() measures."""
+        self._flags |= self._LOADED
 
     def volts(self):
-        """Read voltage as float."""
-        adc = ADC(self._pin)
+        """Read voltage as float, smoothed over measurements."""
+        if self._millivolts == 0 or self._wakes + 1 >= self._interval or \
+                self._flags & self._LOADED:
+            millivolts = self._measure()
+            if self._millivolts == 0:
+                self._millivolts = millivolts
+            else:
+                self._millivolts += \
+                    (millivolts - self._millivolts) >> self._SMOOTHING
+            self._wakes = 0
+            self._flags &= ~self._LOADED
+        else:
+            self._wakes += 1
+        return self._millivolts / 1000
+
+    def _measure(self):
+        # Mean ADC reading with 4 fractional bits, linearized to mV
+        from machine import ADC, Pin
+        adc = ADC(Pin(self._pin))
         adc.atten(adc.ATTN_11DB)
-        sum = 0
-        for x in range(0, self._ADC_READS):
-            sum += adc.read()
-        return self._RESISTOR_RATIO * (sum * self._REFERENCE_VOLTAGE / 4096 /
-                                       self._ADC_READS)
+        total = 0
+        count = 0
+        while count < self._MAX_READS:
+            batch = 0
+            for _ in range(self._BATCH):
+                batch += adc.read()
+            converged = count >= self._MIN_READS - self._BATCH and \
+                abs(batch * count - total * self._BATCH) <= \
+                self._TOLERANCE * self._BATCH * count
+            total += batch
+            count += self._BATCH
+            if converged:
+                break
+        raw = (total << 4) // count
+        index = raw >> 12
+        low = self._LINEAR[index]
+        linear = (low << 4) + (((self._LINEAR[index + 1] - low) *
+                                (raw & 0xfff)) >> 8)
+        return (linear * self._FULL_SCALE_MV) >> 16
@@ -33,7 +33,9 @@
 # THE SOFTWARE.
 
 import time
-from ustruct import unpack, unpack_from
+import ubinascii
+from i2c_bus import FAST
+from ustruct import calcsize, pack, unpack, unpack_from
 from array import array
 
 # BME280 default address.
@@ -45,18 +47,142 @@ BME280_OSAMPLE_2 = 2
 BME280_OSAMPLE_4 = 3
 BME280_OSAMPLE_8 = 4
 BME280_OSAMPLE_16 = 5
+BME280_SKIPPED = 0  # channel not measured
 
+# IIR filter coefficients
+BME280_FILTER_OFF = 0
+BME280_FILTER_2 = 1
+BME280_FILTER_4 = 2
+BME280_FILTER_8 = 3
+BME280_FILTER_16 = 4
+
+# Standby times between measurements in normal mode
+BME280_STANDBY_0_5_MS = 0
+BME280_STANDBY_62_5_MS = 1
+BME280_STANDBY_125_MS = 2
+BME280_STANDBY_250_MS = 3
+BME280_STANDBY_500_MS = 4
+BME280_STANDBY_1000_MS = 5
+BME280_STANDBY_10_MS = 6
+BME280_STANDBY_20_MS = 7
+
+# Channels to compensate
+BME280_TEMPERATURE = 1
+BME280_PRESSURE = 2
+BME280_HUMIDITY = 4
+
+BME280_REGISTER_CHIP_ID = 0xD0
 BME280_REGISTER_CONTROL_HUM = 0xF2
+BME280_REGISTER_STATUS = 0xF3
 BME280_REGISTER_CONTROL = 0xF4
+BME280_REGISTER_CONFIG = 0xF5
+
+BME280_CHIP_ID = 0x60
+
+# Compensation engines, INT32 allocates no big ints over the operating
+# range, its pressure is within 2Pa of INT64 (tools/bench_bme280.py),
+# temperature and humidity are the same
+BME280_COMPENSATION_INT64 = 0
+BME280_COMPENSATION_INT32 = 1
+
+# Parsed calibration values dig_T1 to dig_H6, as cached by the calibration
+# property
+_CALIBRATION = '<HhhHhhhhhhhhBhBhhb'
+_CALIBRATION_SIZE = calcsize(_CALIBRATION)
+
+# Poll interval of the status register measuring bit
+_POLL_US = 250
+
+
+def _mul_shr(a, b, shift):
+    # (a * b) >> shift for shift >= 8, b split at its low byte so the
+    # products are small ints whenever a * 256 is
+    return (a * (b >> 8) + ((a * (b & 0xff)) >> 8)) >> (shift - 8)
+
+
+class Profile:
+    """ Measurement settings: the oversampling of each channel,
+        BME280_SKIPPED to not measure it, the IIR filter of temperature and
+        pressure, and the standby time, None for forced mode where each
+        reading triggers a measurement, otherwise normal mode measuring
+        continuously.
+    """
+
+    def __init__(self, temperature, pressure, humidity,
+                 iir_filter=BME280_FILTER_OFF, standby=None):
+        self.temperature = temperature
+        self.pressure = pressure
+        self.humidity = humidity
+        self.iir_filter = iir_filter
+        self.standby = standby
+        self.channels = BME280_TEMPERATURE
+        if pressure:
+            self.channels |= BME280_PRESSURE
+        if humidity:
+            self.channels |= BME280_HUMIDITY
+
+    @property
+    def conversion_us(self):
+        """ typical time of a measurement, datasheet 9.1 """
+        return self._time(1000, 2000, 500)
+
+    @property
+    def max_conversion_us(self):
+        """ maximum time of a measurement, datasheet 9.1 """
+        return self._time(1250, 2300, 575)
+
+    def _time(self, start, sample, channel):
+        us = start + sample * _samples(self.temperature)
+        if self.pressure:
+            us += sample * _samples(self.pressure) + channel
+        if self.humidity:
+            us += sample * _samples(self.humidity) + channel
+        return us
+
+
+def _samples(oversampling):
+    return 1 << (oversampling - 1) if oversampling else 0
+
+
+# Named profiles, after the recommended modes of datasheet 3.5
+PROFILES = {
+    # Humidity sensing, one sample of temperature and humidity on demand
+    'ultra-low-power': Profile(BME280_OSAMPLE_1, BME280_SKIPPED,
+                               BME280_OSAMPLE_1),
+    # Weather monitoring, one sample of each channel on demand
+    'weather-monitoring': Profile(BME280_OSAMPLE_1, BME280_OSAMPLE_1,
+                                  BME280_OSAMPLE_1),
+    # Measured every second and filtered, so a reading waits for nothing
+    'indoor-monitoring': Profile(BME280_OSAMPLE_2, BME280_SKIPPED,
+                                 BME280_OSAMPLE_2, BME280_FILTER_4,
+                                 BME280_STANDBY_1000_MS)}
 
 
 class BME280:
 
+    # Chip id, parsed calibration values and their CRC32
+    CALIBRATION_SIZE = 1 + _CALIBRATION_SIZE + 4
+
     def __init__(self,
                  mode=BME280_OSAMPLE_1,
                  address=BME280_I2CADDR,
                  i2c=None,
+                 calibration=None,
+                 compensation=BME280_COMPENSATION_INT64,
+                 profile=None,
+                 configured=False,
                  **kwargs):
+        """ i2c is the i2c_bus.I2CBus of the sensor.
+            calibration is bytes from the calibration property of a previous
+            instance, used instead of reading the calibration from the
+            sensor if its chip id and checksum match. compensation is the
+            engine, BME280_COMPENSATION_INT32 avoids allocating big ints
+            on MicroPython. profile is a Profile or the name of one in
+            PROFILES, used instead of mode to oversample each channel
+            equally. configured skips writing the profile to a sensor that
+            already has it, left running while the esp32 was in deep
+            sleep.
+        """
         # Check that mode is valid.
         if mode not in [BME280_OSAMPLE_1, BME280_OSAMPLE_2, BME280_OSAMPLE_4,
                         BME280_OSAMPLE_8, BME280_OSAMPLE_16]:
@@ -64,19 +190,86 @@ class BME280:
                 'Unexpected mode value {0}. Set mode to one of '
                 'BME280_ULTRALOWPOWER, BME280_STANDARD, BME280_HIGHRES, or '
                 'BME280_ULTRAHIGHRES'.format(mode))
-        self._mode = mode
+        if profile is None:
+            profile = Profile(mode, mode, mode)
+        elif isinstance(profile, str):
+            profile = PROFILES[profile]
+        self.profile = profile
+        self._compensation = compensation
         self.address = address
         if i2c is None:
             raise ValueError('An I2C object is required.')
-        self.i2c = i2c
+        self._device = i2c.device(address, FAST)
+
+        chip_id = self._device.read_u8(BME280_REGISTER_CHIP_ID)
+        if not self._load_calibration(chip_id, calibration):
+            self._read_calibration()
+        self._chip_id = chip_id
+
+        self.t_fine = 0
 
-        # load calibration data
-        dig_88_a1 = self.i2c.readfrom_mem(self.address, 0x88, 26)
-        dig_e1_e7 = self.i2c.readfrom_mem(self.address, 0xE1, 7)
+        # temporary data holders which stay allocated
+        self._l8_barray = bytearray(8)
+        self._l3_resultarray = array("i", [0, 0, 0])
+
+        # ctrl_meas without the mode bits
+        self._control = profile.temperature << 5 | profile.pressure << 2
+        # In normal mode the first reading waits for the first measurement
+        self._measured = configured
+        if not configured:
+            self._configure()
+
+    def _configure(self):
+        # Settings are written in sleep mode, ctrl_hum only takes effect
+        # with the following ctrl_meas write (datasheet 5.4.3, 5.4.6)
+        profile = self.profile
+        self._write(BME280_REGISTER_CONTROL, 0)
+        self._write(BME280_REGISTER_CONFIG,
+                    (profile.standby or 0) << 5 | profile.iir_filter << 2)
+        self._write(BME280_REGISTER_CONTROL_HUM, profile.humidity)
+        self._write(BME280_REGISTER_CONTROL,
+                    self._control | (0 if profile.standby is None else 3))
+
+    def _write(self, register, value):
+        self._device.write_u8(register, value)
+
+    @property
+    def calibration(self):
+        """ calibration values as bytes, to keep and pass to a later
+            instance
+        """
+        data = bytes([self._chip_id]) + pack(
+            _CALIBRATION, self.dig_T1, self.dig_T2, self.dig_T3,
+            self.dig_P1, self.dig_P2, self.dig_P3, self.dig_P4, self.dig_P5,
+            self.dig_P6, self.dig_P7, self.dig_P8, self.dig_P9, self.dig_H1,
+            self.dig_H2, self.dig_H3, self.dig_H4, self.dig_H5, self.dig_H6)
+        return data + pack('<I', ubinascii.crc32(data) & 0xffffffff)
+
+    def _load_calibration(self, chip_id, calibration):
+        # Use cached calibration if it is for this chip and intact
+        if calibration is None or len(calibration) != self.CALIBRATION_SIZE \
+                or calibration[0] != chip_id or chip_id != BME280_CHIP_ID:
+            return False
+        data = calibration[:-4]
+        if unpack('<I', calibration[-4:])[0] != \
+                ubinascii.crc32(data) & 0xffffffff:
+            return False
+        self.dig_T1, self.dig_T2, self.dig_T3, self.dig_P1, \
+            self.dig_P2, self.dig_P3, self.dig_P4, self.dig_P5, \
+            self.dig_P6, self.dig_P7, self.dig_P8, self.dig_P9, \
+            self.dig_H1, self.dig_H2, self.dig_H3, self.dig_H4, \
+            self.dig_H5, self.dig_H6 = unpack_from(_CALIBRATION, data, 1)
+        return True
+
+    def _read_calibration(self):
+        # load calibration data, each read is parsed before the next
+        # reuses the bus buffer
+        dig_88_a1 = self._device.read(0x88, 26)
         self.dig_T1, self.dig_T2, self.dig_T3, self.dig_P1, \
             self.dig_P2, self.dig_P3, self.dig_P4, self.dig_P5, \
             self.dig_P6, self.dig_P7, self.dig_P8, self.dig_P9, \
             _, self.dig_H1 = unpack("<HhhHhhhhhhhhBB", dig_88_a1)
+        dig_e1_e7 = self._device.read(0xE1, 7)
 
         self.dig_H2, self.dig_H3 = unpack("<hB", dig_e1_e7)
         e4_sign = unpack_from("<b", dig_e1_e7, 3)[0]
@@ -87,15 +280,6 @@ class BME280:
 
         self.dig_H6 = unpack_from("<b", dig_e1_e7, 6)[0]
 
-        self.i2c.writeto_mem(self.address, BME280_REGISTER_CONTROL,
-                             bytearray([0x3F]))
-        self.t_fine = 0
-
-        # temporary data holders which stay allocated
-        self._l1_barray = bytearray(1)
-        self._l8_barray = bytearray(8)
-        self._l3_resultarray = array("i", [0, 0, 0])
-
     def read_raw_data(self, result):
         """ Reads the raw (uncompensated) data from the sensor.
 
@@ -106,20 +290,24 @@ class BME280:
                 None
         """
 
-        self._l1_barray[0] = self._mode
-        self.i2c.writeto_mem(self.address, BME280_REGISTER_CONTROL_HUM,
-                             self._l1_barray)
-        self._l1_barray[0] = self._mode << 5 | self._mode << 2 | 1
-        self.i2c.writeto_mem(self.address, BME280_REGISTER_CONTROL,
-                             self._l1_barray)
-
-        sleep_time = 1250 + 2300 * (1 << self._mode)
-        sleep_time = sleep_time + 2300 * (1 << self._mode) + 575
-        sleep_time = sleep_time + 2300 * (1 << self._mode) + 575
-        time.sleep_us(sleep_time)  # Wait the required time
+        profile = self.profile
+        if profile.standby is None:
+            # forced mode, one measurement
+            self._write(BME280_REGISTER_CONTROL, self._control | 1)
+            self._measured = False
+        if not self._measured:
+            # Wait the typical measurement time, then poll the measuring
+            # bit until the conversion completes, at most the maximum time
+            typical = profile.conversion_us
+            time.sleep_us(typical)
+            waited = typical
+            while waited < profile.max_conversion_us and self._measuring():
+                time.sleep_us(_POLL_US)
+                waited += _POLL_US
+            self._measured = profile.standby is not None
 
         # burst readout from 0xF7 to 0xFE, recommended by datasheet
-        self.i2c.readfrom_mem_into(self.address, 0xF7, self._l8_barray)
+        self._device.read_into(0xF7, self._l8_barray)
         readout = self._l8_barray
         # pressure(0xF7): ((msb << 16) | (lsb << 8) | xlsb) >> 4
         raw_press = ((readout[0] << 16) | (readout[1] << 8) | readout[2]) >> 4
@@ -132,28 +320,64 @@ class BME280:
         result[1] = raw_press
         result[2] = raw_hum
 
-    def read_compensated_data(self, result=None):
+    def _measuring(self):
+        # status register bit 3: measuring
+        return self._device.read_u8(BME280_REGISTER_STATUS) & 0x08 != 0
+
+    def read_compensated_data(self, result=None, channels=None):
         """ Reads the data from the sensor and returns the compensated data.
 
             Args:
                 result: array of length 3 or alike where the result will be
                 stored, in temperature, pressure, humidity order. You may use
                 this to read out the sensor without allocating heap memory
+                channels: BME280_PRESSURE and BME280_HUMIDITY to compensate,
+                temperature always is, the profile's channels if None. The
+                others are 0
 
             Returns:
                 array with temperature, pressure, humidity. Will be the one from
                 the result parameter if not None
         """
         self.read_raw_data(self._l3_resultarray)
-        raw_temp, raw_press, raw_hum = self._l3_resultarray
-        # temperature
-        var1 = ((raw_temp >> 3) - (self.dig_T1 << 1)) * (self.dig_T2 >> 11)
+        if not result:
+            result = array("i", (0, 0, 0))
+        self.compensate(self._l3_resultarray, result, channels)
+        return result
+
+    def compensate(self, raw, result, channels=None):
+        """ Compensates raw data with the engine chosen at construction.
+
+            Args:
+                raw: temperature, pressure, humidity as from read_raw_data
+                result: array of length 3 or alike where the compensated
+                data will be stored, as from read_compensated_data
+                channels: as for read_compensated_data
+        """
+        if channels is None:
+            channels = self.profile.channels
+        pressure = channels & BME280_PRESSURE
+        humidity = channels & BME280_HUMIDITY
+        if self._compensation == BME280_COMPENSATION_INT32:
+            result[0] = self._temperature_int32(raw[0])
+            result[1] = self._pressure_int32(raw[1]) if pressure else 0
+            result[2] = self._humidity_int32(raw[2]) if humidity else 0
+        else:
+            result[0] = self._temperature_int64(raw[0])
+            result[1] = self._pressure_int64(raw[1]) if pressure else 0
+            result[2] = self._humidity_int64(raw[2]) if humidity else 0
+
+    # Bosch reference, 64 bit integers for pressure (datasheet 4.2.3). The
+    # temperature sets t_fine for the pressure and humidity.
+
+    def _temperature_int64(self, raw_temp):
+        var1 = (((raw_temp >> 3) - (self.dig_T1 << 1)) * self.dig_T2) >> 11
         var2 = (((((raw_temp >> 4) - self.dig_T1) *
                   ((raw_temp >> 4) - self.dig_T1)) >> 12) * self.dig_T3) >> 14
         self.t_fine = var1 + var2
-        temp = (self.t_fine * 5 + 128) >> 8
+        return (self.t_fine * 5 + 128) >> 8
 
-        # pressure
+    def _pressure_int64(self, raw_press):
         var1 = self.t_fine - 128000
         var2 = var1 * var1 * self.dig_P6
         var2 = var2 + ((var1 * self.dig_P5) << 17)
@@ -162,15 +386,14 @@ class BME280:
                 ((var1 * self.dig_P2) << 12))
         var1 = (((1 << 47) + var1) * self.dig_P1) >> 33
         if var1 == 0:
-            pressure = 0
-        else:
-            p = 1048576 - raw_press
-            p = (((p << 31) - var2) * 3125) // var1
-            var1 = (self.dig_P9 * (p >> 13) * (p >> 13)) >> 25
-            var2 = (self.dig_P8 * p) >> 19
-            pressure = ((p + var1 + var2) >> 8) + (self.dig_P7 << 4)
+            return 0
+        p = 1048576 - raw_press
+        p = (((p << 31) - var2) * 3125) // var1
+        var1 = (self.dig_P9 * (p >> 13) * (p >> 13)) >> 25
+        var2 = (self.dig_P8 * p) >> 19
+        return ((p + var1 + var2) >> 8) + (self.dig_P7 << 4)
 
-        # humidity
+    def _humidity_int64(self, raw_hum):
         h = self.t_fine - 76800
         h = (((((raw_hum << 14) - (self.dig_H4 << 20) -
                 (self.dig_H5 * h)) + 16384)
@@ -180,22 +403,72 @@ class BME280:
         h = h - (((((h >> 15) * (h >> 15)) >> 7) * self.dig_H1) >> 4)
         h = 0 if h < 0 else h
         h = 419430400 if h > 419430400 else h
-        humidity = h >> 12
+        return h >> 12
 
-        if result:
-            result[0] = temp
-            result[1] = pressure
-            result[2] = humidity
-            return result
+    # Bosch 32 bit variant (datasheet 8.2), rearranged so that within the
+    # operating range every intermediate fits a MicroPython small int:
+    # products that are shifted are split by _mul_shr, the pressure
+    # division is split with its remainder.
 
-        return array("i", (temp, pressure, humidity))
+    def _temperature_int32(self, raw_temp):
+        # the same as the reference
+        var1 = _mul_shr((raw_temp >> 3) - (self.dig_T1 << 1), self.dig_T2,
+                        11)
+        var2 = (raw_temp >> 4) - self.dig_T1
+        var2 = _mul_shr(_mul_shr(var2, var2, 12), self.dig_T3, 14)
+        self.t_fine = var1 + var2
+        return (self.t_fine * 5 + 128) >> 8
 
-    def read_data(self):
-        """Read data as tuple of float values (C, hPa, %RH)."""
-        t, p, h = self.read_compensated_data()
+    def _pressure_int32(self, raw_press):
+        # in Pa, the low bits of the shifted sums are dropped
+        var1 = (self.t_fine >> 1) - 64000
+        var2 = var1 >> 2
+        var2 = (_mul_shr(_mul_shr(var2, var2, 11), self.dig_P6, 14) +
+                _mul_shr(var1, self.dig_P5, 13) + (self.dig_P4 << 4))
+        # var1 with 4 more bits than the datasheet for the division
+        p = var1 >> 2
+        var1 = (_mul_shr(_mul_shr(p, p, 13), self.dig_P3, 17) +
+                _mul_shr(var1, self.dig_P2, 15))
+        var1 = _mul_shr(524288 + var1, self.dig_P1, 15)
+        if var1 == 0:
+            return 0
+        # (1048576 - raw_press - var2) * 16 * 125 * 50 // var1, a factor at
+        # a time carrying the remainder
+        p = (1048576 - raw_press - var2) << 4
+        q = p // var1
+        p = (p - q * var1) * 125
+        var2 = p // var1
+        p = (p - var2 * var1) * 50
+        p = q * 6250 + var2 * 50 + p // var1
+        var1 = _mul_shr(_mul_shr(p >> 3, p >> 3, 13), self.dig_P9, 12)
+        var2 = _mul_shr(p >> 2, self.dig_P8, 13)
+        return (p + ((var1 + var2 + self.dig_P7) >> 4)) << 8
+
+    def _humidity_int32(self, raw_hum):
+        # the same as the reference
+        h = self.t_fine - 76800
+        var1 = (raw_hum - (self.dig_H4 << 6) + 1 +
+                _mul_shr(-h, self.dig_H5, 14)) >> 1
+        var2 = _mul_shr(_mul_shr(h, self.dig_H6, 10),
+                        _mul_shr(h, self.dig_H3, 11) + 32768, 10) + 2097152
+        h = var1 * ((_mul_shr(var2, self.dig_H2, 13) + 1) >> 1)
+        h = h - (((((h >> 15) * (h >> 15)) >> 7) * self.dig_H1) >> 4)
+        h = 0 if h < 0 else h
+        h = 419430400 if h > 419430400 else h
+        return h >> 12
+
+    def read_data(self, channels=None):
+        """Read data as tuple of float values (C, hPa, %RH).
+
+        channels is as for read_compensated_data, the values of the others
+        are None.
+        """
+        if channels is None:
+            channels = self.profile.channels
+        t, p, h = self.read_compensated_data(channels=channels)
         temp = t / 100
-        hum = h / 1024
-        pressure = p / 256 / 100
+        hum = h / 1024 if channels & BME280_HUMIDITY else None
+        pressure = p / 256 / 100 if channels & BME280_PRESSURE else None
 
         return (temp, pressure, hum)
 
@@ -3,9 +3,53 @@ CCS811 Indoor Air Quality Sensor.
 
 Based on CCS811 datasheet. Inspired by Adafruit and Sparkfun libraries
 """
-import logging
 import utime
 from micropython import const
+from i2c_bus import FAST
+
+
+class Result:
+    """Measurement read from the CCS811 in one burst.
+
+    The same object is updated by each read, copy the values to keep them.
+    """
+
+    def __init__(self):
+        """Create with no measurement."""
+        self.eco2 = 0  # ppm
+        self.tvoc = 0  # ppb
+        self.status = 0
+        self.error_id = 0
+        self.raw = 0
+
+    @property
+    def data_ready(self):
+        """True if the measurement is new."""
+        # Figure 12 in datasheet: status register bit 3: DATA_READY
+        return (self.status >> 3) & 0x01 == 1
+
+    @property
+    def app_running(self):
+        """True if the application is running, not the boot mode."""
+        # Figure 12 in datasheet: bit 7: FW_MODE, bit 4: APP_VALID
+        return self.status & 0x90 == 0x90
+
+    @property
+    def error(self):
+        """True if the sensor reported an error, see error_id."""
+        # Figure 12 in datasheet: status register bit 0: ERROR
+        return self.status & 0x01 == 1
+
+    @property
+    def current(self):
+        """Sensor current in uA, from the raw data."""
+        # Figure 15 in datasheet
+        return self.raw >> 10
+
+    @property
+    def voltage(self):
+        """Sensor voltage ADC reading, 1.65V full scale, from the raw data."""
+        return self.raw & 0x3ff
 
 
 class CCS811:
@@ -21,35 +65,51 @@ class CCS811:
     __MODE_REG = 0x01
     __DATA_REG = 0x02
     __ENV_REG = 0x05
+    __THRESHOLDS_REG = 0x10
     __BASELINE_REG = 0x11
     __HARDWARE_ID_REG = 0x20
     __ERROR_REG = 0xe0
     __APP_START_REG = 0xf4
     __RESET_REG = 0xff
 
+    __RESET_SEQUENCE = b'\x11\xe5\x72\x8a'
+
     __DEVICE_MSG = 'CCS811 not found, check wiring, pull nWake to GND'
     __APPLICATION_MSG = 'Application not valid'
 
     __ADDRESS = 0x5A
 
     def __init__(self, i2c, mode=DRIVE_MODE_1SEC, address=__ADDRESS,
-                 log_level=logging.ERROR):
-        """Initialize sensor in the specified mode."""
-        self._i2c = i2c
-        self._addr = address
+                 log_level=None, validated=False):
+        """Initialize sensor in the specified mode.
+
+        i2c is the i2c_bus.I2CBus of the sensor. log_level is a logging
+        module level, logging is only imported if it is supplied.
+        validated skips the start up wait and the checks of the device,
+        its hardware and application, for a sensor already validated and
+        running (after a deep sleep of the esp32).
+        """
+        self._device = i2c.device(address, FAST)
         self._tVOC = 0
         self._eCO2 = 0
-
-        logging.basicConfig(level=log_level)
-        self._log = logging.getLogger("ccs811")
-
-        utime.sleep_ms(20)  # tSTART, figure 7 of datasheet
-        self._validate_device_present()
-        self._validate_hardware()
-        self._validate_application_present()
+        self._result = Result()
+        self._data = bytearray(8)
+
+        self._debug = False
+        if log_level is not None:
+            import logging
+            logging.basicConfig(level=log_level)
+            self._log = logging.getLogger("ccs811")
+            self._debug = log_level <= logging.DEBUG
+
+        if not validated:
+            utime.sleep_ms(20)  # tSTART, figure 7 of datasheet
+            self._validate_device_present()
+            self._validate_hardware()
+            self._validate_application_present()
         if mode is not None:
             self._start_application()
-            self._set_mode(mode)
+            self.set_mode(mode)
 
     @property
     def tvoc(self):
@@ -69,13 +129,7 @@ class CCS811:
 
     def data_ready(self):
         """Return true if new data is ready. Values in eCO2 and tVOC."""
-        status = self._read_status()
-        # bit 3 in the status register: data_ready
-        if (status[0] >> 3) & 0x01:
-            self.read()
-            return True
-        else:
-            return False
+        return self.read_result().data_ready
 
     def __str__(self):
         """Return human readable values."""
@@ -86,14 +140,27 @@ class CCS811:
 
         Use this method after receiving an interrupt from nINT pin.
         """
+        self.read_result()
+
+    def read_result(self):
+        """Read the measurement, status and error in one burst.
+
+        Returns a Result, the same object each call. Also updates eco2 and
+        tvoc, the latest values whether or not they are new.
+        """
         # datasheet Figure 14: Algorithm Register Byte Order (0x02)
-        register = self.__read_register(self.__DATA_REG, 4)
-        co2HB = register[0]
-        co2LB = register[1]
-        tVOCHB = register[2]
-        tVOCLB = register[3]
-        self._eCO2 = ((co2HB << 8) | co2LB)
-        self._tVOC = ((tVOCHB << 8) | tVOCLB)
+        data = self._data
+        self._device.read_into(self.__DATA_REG, data)
+        self.__log_register_operation("read", self.__DATA_REG, data)
+        result = self._result
+        result.eco2 = (data[0] << 8) | data[1]
+        result.tvoc = (data[2] << 8) | data[3]
+        result.status = data[4]
+        result.error_id = data[5]
+        result.raw = (data[6] << 8) | data[7]
+        self._eCO2 = result.eco2
+        self._tVOC = result.tvoc
+        return result
 
     def get_baseline(self):
         """Get the current baseline value."""
@@ -104,15 +171,16 @@ class CCS811:
 
     def put_baseline(self, baseline):
         """Set the baseline value."""
-        register = bytearray([0x00, 0x00])
+        register = self._device.buffer(2)
         register[0] = baseline >> 8
         register[1] = baseline & 0xff
         self.__write_register(self.__BASELINE_REG, register)
 
     def put_envdata(self, humidity, temp):
         """Set the environment data (temperature and humidity)."""
-        envregister = bytearray([0x00, 0x00, 0x00, 0x00])
+        envregister = self._device.buffer(4)
         envregister[0] = int(humidity) << 1
+        envregister[1] = 0
         t = int(temp//1)
         tf = temp % 1
         t_H = (t + 25) << 9
@@ -134,14 +202,12 @@ class CCS811:
     def soft_reset(self):
         """Software reset the device."""
         # Figure 11 in datasheet
-        self.__write_register(self.__RESET_REG,
-                              bytearray([0x11, 0xe5, 0x72, 0x8a]))
+        self.__write_register(self.__RESET_REG, self.__RESET_SEQUENCE)
         utime.sleep_ms(2)  # tSTART, figure 7 in datasheet
 
     def _validate_device_present(self):
         # Check if sensor is available at i2c bus address
-        devices = self._i2c.scan()
-        if self._addr not in devices:
+        if not self._device.present():
             raise ValueError(self.__DEVICE_MSG)
 
     def _validate_hardware(self):
@@ -151,7 +217,7 @@ class CCS811:
             raise ValueError('Wrong Hardware ID.')
 
     def _start_application(self):
-        self._i2c.writeto(self._addr, bytearray([self.__APP_START_REG]))
+        self._device.command(self.__APP_START_REG)
         utime.sleep_ms(1)  # tAPP_START, Figure 7 of datasheet
 
     def _validate_application_present(self):
@@ -161,28 +227,52 @@ class CCS811:
         if not (status[0] >> 4) & 0x01:
             raise ValueError(self.__APPLICATION_MSG)
 
-    def _set_mode(self, mode):
-        self.__write_register(self.__MODE_REG, bytearray([(mode << 4) | 0x8]))
+    def set_mode(self, mode, interrupt_on_threshold=False):
+        """Set the drive mode, nINT is asserted when new data is ready.
+
+        With interrupt_on_threshold nINT is only asserted when eCO2 moves
+        to another band of the thresholds set by set_thresholds.
+        """
+        # Figure 13 in datasheet: bit 3 INT_DATARDY, bit 2 INT_THRESH
+        register = self._device.buffer(1)
+        register[0] = (mode << 4) | 0x8 | (0x4 if interrupt_on_threshold
+                                            else 0)
+        self.__write_register(self.__MODE_REG, register)
+
+    def set_thresholds(self, low_to_medium, medium_to_high, hysteresis=50):
+        """Set the eCO2 ppm thresholds between the low, medium and high bands.
+
+        eCO2 must move hysteresis ppm past a threshold to change band.
+        """
+        # Figure 21 in datasheet
+        register = self._device.buffer(5)
+        register[0] = low_to_medium >> 8
+        register[1] = low_to_medium & 0xff
+        register[2] = medium_to_high >> 8
+        register[3] = medium_to_high & 0xff
+        register[4] = hysteresis
+        self.__write_register(self.__THRESHOLDS_REG, register)
 
     def _read_status(self):
         status = self.__read_register(self.__STATUS_REG, 1)
-        self._log.debug("valid: %d, ready: %d, error: %d",
-                        (status[0] >> 4) & 0x01, (status[0] >> 3) & 0x01,
-                        status[0] & 0x01)
+        if self._debug:
+            self._log.debug("valid: %d, ready: %d, error: %d",
+                            (status[0] >> 4) & 0x01, (status[0] >> 3) & 0x01,
+                            status[0] & 0x01)
         return status
 
     def __write_register(self, register, register_bytes):
         self.__log_register_operation("write", register, register_bytes)
-        self._i2c.writeto_mem(self._addr, register, register_bytes)
+        self._device.write(register, register_bytes)
 
     def __read_register(self, register, bytes):
-        register_bytes = self._i2c.readfrom_mem(self._addr, register, bytes)
+        register_bytes = self._device.read(register, bytes)
         self.__log_register_operation("read", register, register_bytes)
         return register_bytes
 
     def __log_register_operation(self, msg, register, bytes):
         # performance optimisation
-        if logging._level == logging.DEBUG:
+        if self._debug:
             # binary = '{0:#010b}'.format(value)
             self._log.debug("%s register 0x%02x: %s", msg, register,
                             ' '.join('0x{:02x}'.format(x) for x in bytes))
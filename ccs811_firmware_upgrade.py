@@ -11,7 +11,7 @@ import binascii
 
 ADDRESS = 0x5A
 
-i2c = I2C(scl=config.scl, sda=config.sda, freq=100000)
+i2c = I2C(scl=Pin(config.scl), sda=Pin(config.sda), freq=100000)
 
 
 def firmware_upgrade(firmware_file):
@@ -20,7 +20,7 @@ def firmware_upgrade(firmware_file):
     For example: firmware_upgrade('CCS811_SW000246_1-00.bin')
     """
     reset = Pin(config.rst2)
-    wake = config.wake
+    wake = Pin(config.wake, Pin.OUT)
 
     # Pulse Reset pin
     print("Enter boot mode...")
@@ -1,28 +1,82 @@
-"""Configuration file for air quality monitor."""
-from machine import Pin
+"""Configuration file for air quality monitor.
+
+Pins are pin numbers only, each is created when it is needed.
+"""
 
 # Waveshare Display
 baudrate = 20000000
-sck = Pin(2)  # Marked CLK on Waveshare
-mosi = Pin(15)  # Marked DIN on Waveshare
-miso = Pin(23)  # Not used by Waveshare but must be supplied to SPI
-cs = Pin(0)  # Marked CS on Waveshare
-dc = Pin(4)  # Marked DC on Waveshare
-rst1 = Pin(16)  # Marked RST on Waveshare
-busy = Pin(17)  # Marked BUSY on Waveshare
+sck = 2  # Marked CLK on Waveshare
+mosi = 15  # Marked DIN on Waveshare
+miso = 23  # Not used by Waveshare but must be supplied to SPI
+cs = 0  # Marked CS on Waveshare
+dc = 4  # Marked DC on Waveshare
+rst1 = 16  # Marked RST on Waveshare
+busy = 17  # Marked BUSY on Waveshare
+# Light sleep between polls of busy while the display is refreshing,
+# woken by the timer, rather than sleep_ms()
+epd_light_sleep = False
+# Deep sleep mode between updates, False keeps the display configured so
+# waking it sends nothing, for slightly more current while asleep
+epd_deep_sleep = True
+# Full refresh to clear ghosting after this many partial updates or pixels
+# changed by them, and daily at the quiet hour (None for no daily refresh,
+# the RTC time must be set)
+refresh_max_partial = 60
+refresh_max_pixels = 300000
+refresh_quiet_hour = None
 
 # BME-280 and CCS811
-scl = Pin(26)
-sda = Pin(27)
+scl = 26
+sda = 27
+# Measurement profile in bme280.PROFILES, indoor-monitoring measures every
+# second so readings are filtered and ready at each wake, ultra-low-power
+# only measures at a wake
+bme280_profile = 'indoor-monitoring'
 # Following are CCS811 only
-wake = Pin(33, Pin.OUT, value=0)  # Wake ccs811 by default, datasheet figure 4
-int = Pin(34, Pin.IN, Pin.PULL_UP)  # Pulled down by CCS811
-rst2 = 25  # Pin number only, create Pin when needed
+wake = 33  # Output low to wake ccs811, datasheet figure 4
+int = 34  # Input pulled up, pulled down by CCS811
+rst2 = 25
+
+# The CCS811 wakes the esp32 every minute with new data. Once conditioned,
+# co2_wake_on_band only wakes it when eCO2 crosses into another band, with
+# a timer wake to update the temperature and humidity
+co2_wake_on_band = False
+co2_bands = (1500, 2500)  # ppm, low to medium and medium to high
+co2_hysteresis = 50  # ppm
+timer_wake_ms = 600000
 
 # Battery measurement pin on Lolin D32 development board
-battery = Pin(35)
+battery = 35
+# Wakes between battery measurements, the voltage is also measured after a
+# full refresh of the display
+battery_interval = 10
+
+# Readings are logged to a ring of log_segments files of
+# log_segment_records readings (16 bytes each) in log_directory, written
+# every log_batch wakes. 32 segments of 1024 readings keep 3 weeks of
+# readings every minute in 512KB of flash.
+log_directory = 'log'
+log_batch = 10
+log_segments = 32
+log_segment_records = 1024
+# Minimum, maximum and mean of the readings in buckets of each period, as
+# (seconds, buckets kept) from the shortest, in rollup_directory. Every 10
+# minutes for a week, hourly for 3 months and daily for 2 years in 190KB
+# of flash. Buckets are by the RTC time, which must be set, after power on
+# without it the time restarts at 2000-01-01 and old buckets are read as
+# recent.
+rollup_directory = 'rollup'
+rollup_periods = ((600, 1008), (3600, 2208), (86400, 730))
+
+# Graph of the eCO2 trend in the TVOC quadrant, with a smaller TVOC value.
+# Each of its 144 columns is a reading of trend_period seconds, which
+# should be at least the time between wakes, so 150 seconds graphs the last
+# 6 hours. trend_range is the eCO2 ppm at the bottom and top of the graph.
+trend = True
+trend_period = 150
+trend_range = (400, 2000)
 
-# Control Switches (pulled down by switch)
-sw1 = Pin(14, Pin.IN, Pin.PULL_UP)
-sw2 = Pin(12, Pin.IN, Pin.PULL_UP)
-sw3 = Pin(13, Pin.IN, Pin.PULL_UP)
+# Control Switches (input pulled up, pulled down by switch)
+sw1 = 14
+sw2 = 12
+sw3 = 13
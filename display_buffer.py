@@ -1,5 +1,21 @@
 """2.9 inch E-Paper display buffer."""
-import hershey
+import vector_font
+from glyph_cache import Glyph
+
+
+def _stamps(pens, stride):
+    # Each pen run with its buffer row offset and, for each bit position
+    # the run can start at, the masks of the byte it starts in and the next
+    stamps = []
+    for pen in pens:
+        runs = []
+        for dx, dy, pixels in pen:
+            masks = [((1 << pixels)-1) << (16-pixels-s) for s in range(8)]
+            runs.append((dx*stride, dx, dy,
+                         tuple(mask >> 8 for mask in masks),
+                         tuple(mask & 0xFF for mask in masks)))
+        stamps.append(tuple(runs))
+    return tuple(stamps)
 
 
 class Buffer:
@@ -8,69 +24,265 @@ class Buffer:
     WHITE = 255
     BLACK = 0
 
+    # Changed when the pixels drawn change, so glyphs and templates saved
+    # by an earlier version are rendered again
+    RENDERER = 1
+
     PEN_THIN = 0
     PEN_MEDIUM = 1
     PEN_THICK = 2
 
-    def __init__(self, width, height):
-        """Construct buffer with width and height of Waveshare display."""
+    # Pixels a pen draws either side of the line
+    _PEN_RADIUS = (0, 1, 2)
+    # Pen shapes, each a list of (x offset, y offset, pixels) runs along y
+    _PENS = (((0, 0, 1),),
+             ((-1, 0, 1), (0, -1, 3), (1, 0, 1)),
+             ((-2, -1, 3), (-1, -2, 5), (0, -2, 5), (1, -2, 5), (2, -1, 3)))
+
+    def __init__(self, width, height, font=None, cache=None):
+        """Construct buffer with width and height of Waveshare display.
+
+        Text is drawn with the supplied vector_font.Font, by default the
+        compiled Hershey simplex font. If a glyph_cache.GlyphCache is
+        supplied glyphs are rasterized once and then copied into the buffer.
+        """
         self._w = width
         self._h = height
         self._buffer = bytearray(width * height // 8)
+        self._font = font if font is not None else vector_font.Font()
+        self._cache = cache
+        self._dirty = []
+        self._stamps = _stamps(self._PENS, width >> 3)
 
     def background(self, colour):
         """Set background colour of the display."""
-        for i in range(0, 16 * self._h):
-            self._buffer[i] = colour
+        self._fill_bytes(0, len(self._buffer), colour)
+        self.mark_dirty(0, 0, self._h, self._w)
+
+    def fill_rect(self, x, y, w, h, colour):
+        """Fill the rectangle of w by h pixels at x, y with the colour."""
+        self.mark_dirty(x, y, w, h)
+        self._fill_rect(x, y, w, h, colour)
+
+    def hline(self, x, y, length, colour):
+        """Draw a horizontal span of length pixels starting at x, y."""
+        self.fill_rect(x, y, length, 1, colour)
+
+    def vline(self, x, y, length, colour):
+        """Draw a vertical span of length pixels starting at x, y."""
+        self.fill_rect(x, y, 1, length, colour)
+
+    def mark_dirty(self, x, y, w, h):
+        """Mark a rectangle as changed since the dirty regions were cleared.
+
+        The rectangle is widened to whole bytes of the display memory and
+        merged with any dirty region it touches.
+        """
+        x1 = min(x+w-1, self._h-1)
+        y1 = min(y+h-1, self._w-1) | 7
+        x = max(x, 0)
+        y = max(y, 0) & ~7
+        if x > x1 or y > y1:
+            return
+        dirty = self._dirty
+        i = 0
+        while i < len(dirty):
+            rx, ry, rx1, ry1 = dirty[i]
+            if x <= rx1+1 and rx <= x1+1 and y <= ry1+1 and ry <= y1+1:
+                # Merge and start again as the union may touch others
+                x = min(x, rx)
+                y = min(y, ry)
+                x1 = max(x1, rx1)
+                y1 = max(y1, ry1)
+                dirty.pop(i)
+                i = 0
+            else:
+                i += 1
+        dirty.append((x, y, x1, y1))
+
+    def clear_dirty(self):
+        """Forget the dirty regions, for example once sent to the display."""
+        self._dirty = []
+
+    def dirty_rects(self):
+        """Get the dirty regions as display memory windows.
+
+        Windows are (x, y, w, h) in the display's own orientation, x and w
+        are multiples of 8 as required by the display memory.
+        """
+        return [(y, x, y1-y+1, x1-x+1) for x, y, x1, y1 in self._dirty]
 
     def plot(self, x, y, colour):
         """Plot point with the given colour."""
-        tx = y
-        ty = x
+        self.mark_dirty(x, y, 1, 1)
+        self._plot(x, y, colour)
 
+    def line(self, x, y, x2, y2, colour, weight):
+        """Draw line with the given colour and weight."""
+        r = self._PEN_RADIUS[weight]
+        self.mark_dirty(min(x, x2)-r, min(y, y2)-r,
+                        abs(x2-x)+1+2*r, abs(y2-y)+1+2*r)
+        self._line(x, y, x2, y2, colour, weight)
+
+    def blob(self, x, y, colour):
+        """Draw blob with the given colour."""
+        self.mark_dirty(x-2, y-2, 5, 5)
+        self._blob(x, y, colour)
+
+    def _fill_rect(self, x, y, w, h, colour):
+        # Rows of the buffer run along y, so each x is one row of whole
+        # bytes with masked bytes at either end
+        x1 = min(x+w, self._h)
+        y1 = min(y+h, self._w)
+        x = max(x, 0)
+        y = max(y, 0)
+        if x >= x1 or y >= y1:
+            return
+        stride = self._w >> 3
+        first = y >> 3
+        last = (y1-1) >> 3
+        head = 0xFF >> (y & 7)
+        tail = (0xFF << (7-((y1-1) & 7))) & 0xFF
+        if first == last:
+            head &= tail
+        elif y & 7 == 0 and y1 & 7 == 0 and first == 0 and last == stride-1:
+            # Whole rows are a single run of bytes
+            self._fill_bytes(x*stride, x1*stride, colour)
+            return
+        buf = self._buffer
+        for row in range(x*stride, x1*stride, stride):
+            if colour == self.WHITE:
+                buf[row+first] |= head
+            elif colour == self.BLACK:
+                buf[row+first] &= ~head
+            if first != last:
+                if last > first+1:
+                    self._fill_bytes(row+first+1, row+last, colour)
+                if colour == self.WHITE:
+                    buf[row+last] |= tail
+                elif colour == self.BLACK:
+                    buf[row+last] &= ~tail
+
+    def _fill_bytes(self, start, end, colour):
+        # Set bytes start to end to the colour, copying the filled part
+        # onto the rest so the run doubles each step without allocating
+        buf = memoryview(self._buffer)
+        if start >= end:
+            return
+        buf[start] = colour
+        n = 1
+        while start+n < end:
+            size = min(n, end-start-n)
+            buf[start+n:start+n+size] = buf[start:start+size]
+            n += size
+
+    def _span(self, x, y, x2, y2, colour, weight):
+        # Axis aligned line as the union of rectangles the pen covers
+        if y == y2:
+            if x > x2:
+                x, x2 = x2, x
+            n = x2-x+1
+            if weight == self.PEN_THIN:
+                self._fill_rect(x, y, n, 1, colour)
+            elif weight == self.PEN_MEDIUM:
+                self._fill_rect(x, y-1, n, 3, colour)
+                self._fill_rect(x-1, y, n+2, 1, colour)
+            elif weight == self.PEN_THICK:
+                self._fill_rect(x-1, y-2, n+2, 5, colour)
+                self._fill_rect(x-2, y-1, n+4, 3, colour)
+        else:
+            if y > y2:
+                y, y2 = y2, y
+            n = y2-y+1
+            if weight == self.PEN_THIN:
+                self._fill_rect(x, y, 1, n, colour)
+            elif weight == self.PEN_MEDIUM:
+                self._fill_rect(x-1, y, 3, n, colour)
+                self._fill_rect(x, y-1, 1, n+2, colour)
+            elif weight == self.PEN_THICK:
+                self._fill_rect(x-2, y-1, 5, n+2, colour)
+                self._fill_rect(x-1, y-2, 3, n+4, colour)
+
+    def _plot(self, x, y, colour):
         if (x < 0) or (x >= self._h) or (y < 0) or (y >= self._w):
             return
+        i = x*(self._w >> 3)+(y >> 3)
         if colour == self.WHITE:
-            self._buffer[int((tx+ty*self._w)/8)] |= (0x80 >> (tx % 8))
+            self._buffer[i] |= (0x80 >> (y & 7))
         elif colour == self.BLACK:
-            self._buffer[int((tx+ty*self._w)/8)] &= ~(0x80 >> (tx % 8))
+            self._buffer[i] &= ~(0x80 >> (y & 7))
 
-    def line(self, x, y, x2, y2, colour, weight):
-        """Draw line with the given colour and weight."""
-        if x > x2:
-            dx = x - x2
-        else:
-            dx = x2 - x
-        if y > y2:
-            dy = y - y2
+    def _line(self, x, y, x2, y2, colour, weight):
+        if x == x2 or y == y2:
+            self._span(x, y, x2, y2, colour, weight)
+            return
+        if colour == self.WHITE:
+            white = True
+        elif colour == self.BLACK:
+            white = False
         else:
-            dy = y2 - y
+            return
 
+        # Clip once, pixels are only checked if the line is partly outside
+        r = self._PEN_RADIUS[weight]
         if x < x2:
             sx = 1
+            dx = x2-x
+            xmin = x-r
+            xmax = x2+r
         else:
             sx = -1
-
+            dx = x-x2
+            xmin = x2-r
+            xmax = x+r
         if y < y2:
             sy = 1
+            dy = y2-y
+            ymin = y-r
+            ymax = y2+r
         else:
             sy = -1
+            dy = y-y2
+            ymin = y2-r
+            ymax = y+r
+        h = self._h
+        if xmax < 0 or xmin >= h or ymax < 0 or ymin >= self._w:
+            return
+        inside = xmin >= 0 and xmax < h and ymin >= 0 and ymax < self._w
 
-        err = dx - dy
-
+        buf = self._buffer
+        stride = self._w >> 3
+        stamp = self._stamps[weight]
+        base = x*stride
+        step = sx*stride
+        err = dx-dy
         while True:
-            self.plot(x, y, colour)
-            if weight == self.PEN_MEDIUM:
-                if self._h-1 >= x+1:
-                    self.plot(x+1, y, colour)
-                if 0 <= x-1:
-                    self.plot(x-1, y, colour)
-                if self._w-1 >= y+1:
-                    self.plot(x, y+1, colour)
-                if 0 <= y-1:
-                    self.plot(x, y-1, colour)
-            elif weight == self.PEN_THICK:
-                self.blob(x, y, colour)
+            for offset, ox, oy, heads, tails in stamp:
+                yy = y+oy
+                col = yy >> 3
+                head = heads[yy & 7]
+                tail = tails[yy & 7]
+                i = base+offset+col
+                if inside:
+                    if white:
+                        buf[i] |= head
+                        if tail:
+                            buf[i+1] |= tail
+                    else:
+                        buf[i] &= ~head
+                        if tail:
+                            buf[i+1] &= ~tail
+                elif 0 <= x+ox < h:
+                    if 0 <= col < stride:
+                        if white:
+                            buf[i] |= head
+                        else:
+                            buf[i] &= ~head
+                    if tail and 0 <= col+1 < stride:
+                        if white:
+                            buf[i+1] |= tail
+                        else:
+                            buf[i+1] &= ~tail
 
             if (x == x2) and (y == y2):
                 break
@@ -78,42 +290,24 @@ class Buffer:
             if e2 > -dy:
                 err = err-dy
                 x = x+sx
+                base = base+step
             if (x == x2) and (y == y2):
-                self.plot(x, y, colour)
-                if weight == self.PEN_MEDIUM:
-                        if self._h-1 >= x+1:
-                            self.plot(x+1, y, colour)
-                        if 0 <= x-1:
-                            self.plot(x-1, y, colour)
-                        if self._w-1 >= y+1:
-                            self.plot(x, y+1, colour)
-                        if 0 <= y-1:
-                            self.plot(x, y-1, colour)
-                elif weight == self.PEN_THICK:
-                    self.blob(x, y, colour)
-                break
-
+                continue  # draw the end point
             if e2 < dx:
                 err = err+dx
                 y = y+sy
 
-    def blob(self, x, y, colour):
-        """Draw blob with the given colour."""
-        self.line(x-1, y+2,  x+1, y+2, colour, self.PEN_THIN)
-        self.line(x-2, y+1,  x+2, y+1, colour, self.PEN_THIN)
-        self.line(x-2, y,  x+2, y, colour, self.PEN_THIN)
-        self.line(x-2, y-1,  x+2, y-1, colour, self.PEN_THIN)
-        self.line(x-1, y-2,  x+1, y-2, colour, self.PEN_THIN)
+    def _blob(self, x, y, colour):
+        self._line(x-1, y+2,  x+1, y+2, colour, self.PEN_THIN)
+        self._line(x-2, y+1,  x+2, y+1, colour, self.PEN_THIN)
+        self._line(x-2, y,  x+2, y, colour, self.PEN_THIN)
+        self._line(x-2, y-1,  x+2, y-1, colour, self.PEN_THIN)
+        self._line(x-1, y-2,  x+1, y-2, colour, self.PEN_THIN)
 
     def write_text(self, text, x, y, colour, xscale, yscale, dy, weight):
         """Write text with the given colour and size scaling."""
-        old = False
         do_scale = False
-        not_finished = True
-        ci = 0
-        mdy = 0
-        ox = 0
-        oy = 0
+        py = 0
         wt = 0
 
         if (xscale > 1.01) or (xscale < 1.01) or \
@@ -121,71 +315,166 @@ class Buffer:
             do_scale = True
 
         xx = x
-        while not_finished:
-            if ci == len(text):
-                break
-            c = ord(text[ci])
-            ci += 1
+        for ch in text:
+            c = ord(ch)
             if (c > 126) or (c < 32):
                 continue
-            c = c-32
-            nv = hershey.simplex[c][0]
-            w = hershey.simplex[c][1]
-            if w < 0:
-                w = 0-w
-            if nv == 0:
+            glyph = self._font.glyph(c)
+            w = glyph[1]
+            if w > 127:  # glyph bytes are signed
+                w = 256-w
+            if glyph[0] == 0:
                 xx = xx+w
                 wt = wt+w
                 continue
-            im = 2+(nv*2)
-            old = False
-
-            for i in range(2, im, 2):
-                ipx = hershey.simplex[c][i]
-                ipy = hershey.simplex[c][i+1]
-                if ipx >= 0:
-                    px = ipx
-                else:
-                    px = 0-ipx
-                if ipy >= 0:
-                    py = ipy
-                else:
-                    if py == -1:
-                        py = 32767
-                    else:
-                        py = 0+ipy
-
-                if do_scale:
-                    px = int(float(px)*xscale)
-                    py = int(float(py)*yscale)
-                if (py != 32767) and (py > mdy):
-                    mdy = py+1
-                if (ipx == -1) and (ipy == -1):  # pen up
-                    old = False
-                else:
-                    if old:  # a previous point is stored in ox, oy
-                        if ((ox+xx) > (self._h-1)) or ((px+xx) > (self._h-1)):
-                            not_finished = False
-                            break
-                        self.line(ox+xx, oy+y, px+xx, py+y, colour, weight)
-                        ox = px
-                        oy = py
-                    else:
-                        ox = px
-                        oy = py
-                        old = True
+
+            py = self._draw_glyph(c, glyph, xx, y, colour,
+                                  xscale, yscale, do_scale, weight, py)
             if do_scale:
                 xx = xx+int(float(w)*xscale)
                 wt = wt+int(float(w)*xscale)
             else:
                 xx = xx+w
                 wt = wt+w
-
-        if dy is not None:
-            dy = mdy
+            if py is None:  # text has run off the display
+                break
 
         return wt+1
 
+    def _draw_glyph(self, c, glyph, xx, y, colour,
+                    xscale, yscale, do_scale, weight, py):
+        # Blit the glyph from the cache when possible. Glyphs starting below
+        # the baseline depend on the previous glyph so are always stroked.
+        cache = self._cache
+        if cache is not None and glyph[3] < 128:
+            # Scales in thousandths, as the cache file holds them
+            key = (c, int(round(xscale*1000)), int(round(yscale*1000)),
+                   weight)
+            bitmap = cache.get(key)
+            if bitmap is None:
+                bitmap = self._rasterize(glyph, xscale, yscale,
+                                         do_scale, weight)
+                if bitmap is not None:
+                    cache.put(key, bitmap)
+            if bitmap is not None and xx+bitmap.xmax <= self._h-1:
+                self._blit(bitmap, xx, y, colour)
+                return bitmap.py
+        return self._stroke_glyph(glyph, xx, y, colour,
+                                  xscale, yscale, do_scale, weight, py)
+
+    def _stroke_glyph(self, glyph, xx, y, colour,
+                      xscale, yscale, do_scale, weight, py):
+        # Returns the last vertex y, or None if the glyph ran off the display
+        segments, py = self._glyph_segments(glyph, xscale, yscale,
+                                            do_scale, py)
+        for ox, oy, px, qy in segments:
+            if ((ox+xx) > (self._h-1)) or ((px+xx) > (self._h-1)):
+                return None
+            self.line(ox+xx, oy+y, px+xx, qy+y, colour, weight)
+        return py
+
+    def _glyph_segments(self, glyph, xscale, yscale, do_scale, py):
+        # Scaled strokes of a glyph as (x1, y1, x2, y2) and the last vertex y
+        segments = []
+        old = False
+        ox = 0
+        oy = 0
+        for i in range(2, 2+(glyph[0]*2), 2):
+            ipx = glyph[i]
+            ipy = glyph[i+1]
+            if ipx > 127:
+                ipx = ipx-256
+            if ipy > 127:
+                ipy = ipy-256
+            if ipx >= 0:
+                px = ipx
+            else:
+                px = 0-ipx
+            if ipy >= 0:
+                py = ipy
+            else:
+                if py == -1:
+                    py = 32767
+                else:
+                    py = 0+ipy
+
+            if do_scale:
+                px = int(float(px)*xscale)
+                py = int(float(py)*yscale)
+            if (ipx == -1) and (ipy == -1):  # pen up
+                old = False
+            else:
+                if old:  # a previous point is stored in ox, oy
+                    segments.append((ox, oy, px, py))
+                ox = px
+                oy = py
+                old = True
+        return segments, py
+
+    def _rasterize(self, glyph, xscale, yscale, do_scale, weight):
+        # Stroke the glyph into a bitmap just big enough for it and the pen
+        segments, py = self._glyph_segments(glyph, xscale, yscale,
+                                            do_scale, 0)
+        if not segments:
+            return Glyph(0, 0, 0, 1, 0, py, b'')
+        xmin = min(min(s[0], s[2]) for s in segments)
+        xmax = max(max(s[0], s[2]) for s in segments)
+        ymin = min(min(s[1], s[3]) for s in segments)
+        ymax = max(max(s[1], s[3]) for s in segments)
+        if ymax-ymin >= self._w:
+            return None
+        pad = self._PEN_RADIUS[weight]
+        x0 = xmin-pad
+        y0 = ymin-pad
+        rows = xmax-xmin+1+2*pad
+        row_bytes = (ymax-ymin+2*pad)//8+1
+        scratch = Buffer(row_bytes*8, rows, self._font)
+        for ox, oy, px, qy in segments:
+            scratch.line(ox-x0, oy-y0, px-x0, qy-y0, self.WHITE, weight)
+        return Glyph(x0, y0, rows, row_bytes, xmax, py, bytes(scratch.get()))
+
+    def _blit(self, glyph, x, y, colour):
+        # Copy a glyph mask into the buffer, shifting it to the y position
+        buf = self._buffer
+        stride = self._w//8
+        row_bytes = glyph.row_bytes
+        bitmap = glyph.bitmap
+        yb = y+glyph.y0
+        shift = yb & 7
+        first = yb >> 3
+        row = x+glyph.x0
+        self.mark_dirty(row, yb, glyph.rows, row_bytes*8)
+        i = 0
+        for _ in range(glyph.rows):
+            if 0 <= row < self._h:
+                base = row*stride
+                for b in range(row_bytes):
+                    bits = bitmap[i+b]
+                    if bits == 0:
+                        continue
+                    col = first+b
+                    mask = bits >> shift
+                    if mask and 0 <= col < stride:
+                        if colour == self.WHITE:
+                            buf[base+col] |= mask
+                        elif colour == self.BLACK:
+                            buf[base+col] &= ~mask
+                    mask = (bits << (8-shift)) & 0xFF
+                    if mask and 0 <= col+1 < stride:
+                        if colour == self.WHITE:
+                            buf[base+col+1] |= mask
+                        elif colour == self.BLACK:
+                            buf[base+col+1] &= ~mask
+            row += 1
+            i += row_bytes
+
+    def read_from(self, stream):
+        """Fill the buffer from a stream, return False if it was too short."""
+        if stream.readinto(self._buffer) != len(self._buffer):
+            return False
+        self.mark_dirty(0, 0, self._h, self._w)
+        return True
+
     def get(self):
         """Get the filled in buffer."""
         return self._buffer
@@ -26,7 +26,8 @@ SOFTWARE.
 """
 
 from micropython import const
-from time import sleep_ms
+from machine import lightsleep
+from time import sleep_ms, ticks_ms, ticks_diff
 import ustruct
 
 # Display resolution
@@ -57,9 +58,24 @@ SET_RAM_Y_ADDRESS_COUNTER            = const(0x4F)
 TERMINATE_FRAME_READ_WRITE           = const(0xFF)
 
 BUSY = const(1)  # 1=busy, 0=idle
+BUSY_TIMEOUT_MS = const(10000)
+BUSY_POLL_MS = const(5)
+
+# Controller state retained between wakes, see EPD.state
+STATE_CONFIGURED  = const(0x01)
+STATE_DEEP_SLEEP  = const(0x02)
+STATE_LUT_FULL    = const(0x04)
+STATE_LUT_PARTIAL = const(0x08)
+
+# Command sequence buffer, data longer than _SEQ_INLINE is not copied
+_SEQ_BYTES    = const(128)
+_SEQ_COMMANDS = const(48)
+_SEQ_INLINE   = const(32)
 
 class EPD:
-    def __init__(self, spi, cs, dc, rst, busy):
+    # light_sleep waits between BUSY polls in ESP32 light sleep, woken by
+    # its timer, otherwise in sleep_ms()
+    def __init__(self, spi, cs, dc, rst, busy, light_sleep=False):
         self.spi = spi
         self.cs = cs
         self.dc = dc
@@ -71,6 +87,20 @@ class EPD:
         self.busy.init(self.busy.IN)
         self.width = EPD_WIDTH
         self.height = EPD_HEIGHT
+        self.bytes_sent = 0
+        self.transactions = 0  # CS assertions
+        self._seq = bytearray(_SEQ_BYTES)
+        self._seq_view = memoryview(self._seq)
+        self._seq_cmds = bytearray(_SEQ_COMMANDS)  # offset of each command
+        self._seq_rows = [None] * _SEQ_COMMANDS  # data sent from elsewhere
+        self._row = bytearray(EPD_WIDTH // 8)
+        self.begin()
+        self.light_sleep = light_sleep
+        self.busy_ms = {}  # last BUSY duration after each command
+        self._last_command = None
+        self._configured = False
+        self._deep_sleep = False
+        self._lut = None
 
     # 30 bytes (look up tables)
     # original waveshare example
@@ -81,45 +111,208 @@ class EPD:
     #LUT_FULL_UPDATE    = bytearray(b'\x50\xAA\x55\xAA\x11\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xFF\xFF\x1F\x00\x00\x00\x00\x00\x00\x00')
     #LUT_PARTIAL_UPDATE = bytearray(b'\x10\x18\x18\x08\x18\x18\x08\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x13\x14\x44\x12\x00\x00\x00\x00\x00\x00')
 
-    def _command(self, command, data=None):
-        self.dc(0)
-        self.cs(0)
-        self.spi.write(bytearray([command]))
-        self.cs(1)
-        if data is not None:
-            self._data(data)
+    # a command sequence is built in a preallocated buffer, each command
+    # byte followed by its data, and sent with a single CS assertion
+    # toggling DC between commands and data. Large data (images, frame
+    # windows) is referenced by the sequence rather than copied into it.
+    def begin(self):
+        self._seq_len = 0
+        self._seq_count = 0
+
+    def add(self, command, data=None):
+        if data is not None and len(data) > _SEQ_INLINE:
+            self._add_rows(command, (data, 0, len(data), 0, 1))
+            return
+        size = 0 if data is None else len(data)
+        i = self._reserve(command, size)
+        if size:
+            self._seq[i:i + size] = data
 
-    def _data(self, data):
-        self.dc(1)
+    def send(self):
+        seq = self._seq_view
+        cmds = self._seq_cmds
+        count = self._seq_count
+        if count == 0:
+            return
         self.cs(0)
-        self.spi.write(data)
+        for i in range(count):
+            start = cmds[i]
+            end = cmds[i + 1] if i + 1 < count else self._seq_len
+            self.dc(0)
+            self.spi.write(seq[start:start + 1])
+            if end > start + 1:
+                self.dc(1)
+                self.spi.write(seq[start + 1:end])
+            rows = self._seq_rows[i]
+            if rows is not None:
+                self.dc(1)
+                self._write_rows(*rows)
+                self._seq_rows[i] = None
         self.cs(1)
+        self._last_command = self._seq[cmds[count - 1]]
+        self.transactions += 1
+        self.bytes_sent += self._seq_len
+        self.begin()
+
+    def _reserve(self, command, size):
+        # add command with size bytes of data, sending the sequence so far
+        # if it is full, returns the offset of the data
+        if self._seq_len + 1 + size > _SEQ_BYTES or \
+                self._seq_count == _SEQ_COMMANDS:
+            self.send()
+        start = self._seq_len
+        self._seq[start] = command
+        self._seq_rows[self._seq_count] = None
+        self._seq_cmds[self._seq_count] = start
+        self._seq_count += 1
+        self._seq_len = start + 1 + size
+        return start + 1
+
+    def _add_rows(self, command, rows):
+        # add command with its data sent by _write_rows(*rows)
+        self._reserve(command, 0)
+        self._seq_rows[self._seq_count - 1] = rows
 
-    def init(self):
+    def _write_rows(self, data, start, size, stride, count):
+        # count rows of size bytes, stride apart, stride 0 repeats a row
+        if stride == size:
+            size *= count
+            count = 1
+        if start == 0 and size == len(data):
+            for _ in range(count):
+                self.spi.write(data)
+        else:
+            rows = memoryview(data)
+            for row in range(start, start + count * stride, stride):
+                self.spi.write(rows[row:row + size])
+        self.bytes_sent += size * count
+
+    def _command(self, command, data=None):
+        self.begin()
+        self.add(command, data)
+        self.send()
+
+    # state is the controller state saved before the previous deep sleep
+    # of the host, 0 if not known. A configured controller that was not put
+    # in deep sleep mode keeps its settings and LUT, so nothing is sent. Deep
+    # sleep mode needs a reset, which loses the settings and LUT, but it is
+    # known to be idle so a short reset is enough and the LUT is left to be
+    # sent with the next update.
+    def init(self, state=0):
+        if state & STATE_CONFIGURED:
+            if state & STATE_DEEP_SLEEP:
+                self.wake()
+            else:
+                self._configured = True
+                if state & STATE_LUT_FULL:
+                    self._lut = self.LUT_FULL_UPDATE
+                elif state & STATE_LUT_PARTIAL:
+                    self._lut = self.LUT_PARTIAL_UPDATE
+            return
         self.reset()
-        self._command(DRIVER_OUTPUT_CONTROL, ustruct.pack("<HB", EPD_HEIGHT-1, 0x00))
-        self._command(BOOSTER_SOFT_START_CONTROL, b'\xD7\xD6\x9D')
-        self._command(WRITE_VCOM_REGISTER, b'\xA8') # VCOM 7C
-        self._command(SET_DUMMY_LINE_PERIOD, b'\x1A') # 4 dummy lines per gate
-        self._command(SET_GATE_TIME, b'\x08') # 2us per line
-        self._command(DATA_ENTRY_MODE_SETTING, b'\x03') # X increment Y increment
-        self.set_lut(self.LUT_FULL_UPDATE)
-
-    def wait_until_idle(self):
+        self.begin()
+        self._add_settings()
+        self.add_lut(self.LUT_FULL_UPDATE)
+        self.send()
+
+    # leave deep sleep mode
+    def wake(self):
+        self.rst(0)
+        sleep_ms(10)
+        self.rst(1)
+        self._last_command = None
+        self.wait_until_idle()
+        self._deep_sleep = False
+        self._lut = None
+        self.begin()
+        self._add_settings()
+        self.send()
+
+    @property
+    def state(self):
+        state = 0
+        if self._configured:
+            state |= STATE_CONFIGURED
+        if self._deep_sleep:
+            state |= STATE_DEEP_SLEEP
+        if self._lut is self.LUT_FULL_UPDATE:
+            state |= STATE_LUT_FULL
+        elif self._lut is self.LUT_PARTIAL_UPDATE:
+            state |= STATE_LUT_PARTIAL
+        return state
+
+    def _add_settings(self):
+        self.add(DRIVER_OUTPUT_CONTROL, ustruct.pack("<HB", EPD_HEIGHT-1, 0x00))
+        self.add(BOOSTER_SOFT_START_CONTROL, b'\xD7\xD6\x9D')
+        self.add(WRITE_VCOM_REGISTER, b'\xA8') # VCOM 7C
+        self.add(SET_DUMMY_LINE_PERIOD, b'\x1A') # 4 dummy lines per gate
+        self.add(SET_GATE_TIME, b'\x08') # 2us per line
+        self.add(DATA_ENTRY_MODE_SETTING, b'\x03') # X increment Y increment
+        self._configured = True
+
+    # wait until BUSY is low, polling every BUSY_POLL_MS, recording how
+    # long the last command sent kept the display busy
+    def wait_until_idle(self, timeout_ms=BUSY_TIMEOUT_MS):
+        start = ticks_ms()
         while self.busy.value() == BUSY:
-            sleep_ms(100)
+            if ticks_diff(ticks_ms(), start) >= timeout_ms:
+                raise OSError('EPD busy timeout')
+            if self.light_sleep:
+                lightsleep(BUSY_POLL_MS)
+            else:
+                sleep_ms(BUSY_POLL_MS)
+        self.busy_ms[self._last_command] = ticks_diff(ticks_ms(), start)
 
     def reset(self):
         self.rst(0)
         sleep_ms(200)
         self.rst(1)
         sleep_ms(200)
+        self._configured = False
+        self._deep_sleep = False
+        self._lut = None
 
     def set_lut(self, lut):
-        self._command(WRITE_LUT_REGISTER, lut)
+        self.begin()
+        self.add_lut(lut)
+        self.send()
+
+    # the LUT is only sent if it is not already the active one
+    def add_lut(self, lut):
+        if lut is not self._lut:
+            self.add(WRITE_LUT_REGISTER, lut)
+            self._lut = lut
 
     # put an image in the frame memory
     def set_frame_memory(self, image, x, y, w, h):
+        self.begin()
+        self.add_frame_memory(image, x, y, w, h)
+        self.send()
+
+    def add_frame_memory(self, image, x, y, w, h):
+        x, y, x_end, y_end = self._window(x, y, w, h)
+        self.add_memory_area(x, y, x_end, y_end)
+        self.add_memory_pointer(x, y)
+        self.add(WRITE_RAM, image)
+
+    # put a window of a full frame image in the frame memory, sending each
+    # row of the window as a slice of the frame without copying it
+    def set_frame_window(self, frame, x, y, w, h):
+        self.begin()
+        self.add_frame_window(frame, x, y, w, h)
+        self.send()
+
+    def add_frame_window(self, frame, x, y, w, h):
+        x, y, x_end, y_end = self._window(x, y, w, h)
+        self.add_memory_area(x, y, x_end, y_end)
+        self.add_memory_pointer(x, y)
+        stride = self.width // 8
+        start = x >> 3
+        self._add_rows(WRITE_RAM, (frame, y * stride + start,
+                                   (x_end >> 3) + 1 - start, stride,
+                                   y_end - y + 1))
+
+    def _window(self, x, y, w, h):
         # x point must be the multiple of 8 or the last 3 bits will be ignored
         x = x & 0xF8
         w = w & 0xF8
@@ -133,44 +326,77 @@ class EPD:
             y_end = self.height - 1
         else:
             y_end = y + h - 1
-
-        self.set_memory_area(x, y, x_end, y_end)
-        self.set_memory_pointer(x, y)
-        self._command(WRITE_RAM, image)
+        return x, y, x_end, y_end
 
     # replace the frame memory with the specified color
     def clear_frame_memory(self, color):
-        self.set_memory_area(0, 0, self.width - 1, self.height - 1)
-        self.set_memory_pointer(0, 0)
-        self._command(WRITE_RAM)
-        # send the color data
-        for i in range(0, self.width // 8 * self.height):
-            self._data(bytearray([color]))
+        row = self._row
+        for i in range(len(row)):
+            row[i] = color
+        self.begin()
+        self.add_memory_area(0, 0, self.width - 1, self.height - 1)
+        self.add_memory_pointer(0, 0)
+        # the color data, one row repeated
+        self._add_rows(WRITE_RAM, (row, 0, len(row), 0, self.height))
+        self.send()
 
     # draw the current frame memory and switch to the next memory area
     def display_frame(self):
-        self._command(DISPLAY_UPDATE_CONTROL_2, b'\xC4')
-        self._command(MASTER_ACTIVATION)
-        self._command(TERMINATE_FRAME_READ_WRITE)
+        self.begin()
+        self.add_display_frame()
+        self.send()
         self.wait_until_idle()
 
+    def add_display_frame(self):
+        self.add(DISPLAY_UPDATE_CONTROL_2, b'\xC4')
+        self.add(MASTER_ACTIVATION)
+        self.add(TERMINATE_FRAME_READ_WRITE)
+
     # specify the memory area for data R/W
     def set_memory_area(self, x_start, y_start, x_end, y_end):
-        self._command(SET_RAM_X_ADDRESS_START_END_POSITION)
+        self.begin()
+        self.add_memory_area(x_start, y_start, x_end, y_end)
+        self.send()
+
+    def add_memory_area(self, x_start, y_start, x_end, y_end):
+        seq = self._seq
+        i = self._reserve(SET_RAM_X_ADDRESS_START_END_POSITION, 2)
         # x point must be the multiple of 8 or the last 3 bits will be ignored
-        self._data(bytearray([(x_start >> 3) & 0xFF]))
-        self._data(bytearray([(x_end >> 3) & 0xFF]))
-        self._command(SET_RAM_Y_ADDRESS_START_END_POSITION, ustruct.pack("<HH", y_start, y_end))
+        seq[i] = (x_start >> 3) & 0xFF
+        seq[i + 1] = (x_end >> 3) & 0xFF
+        i = self._reserve(SET_RAM_Y_ADDRESS_START_END_POSITION, 4)
+        seq[i] = y_start & 0xFF
+        seq[i + 1] = (y_start >> 8) & 0xFF
+        seq[i + 2] = y_end & 0xFF
+        seq[i + 3] = (y_end >> 8) & 0xFF
 
     # specify the start point for data R/W
     def set_memory_pointer(self, x, y):
-        self._command(SET_RAM_X_ADDRESS_COUNTER)
-        # x point must be the multiple of 8 or the last 3 bits will be ignored
-        self._data(bytearray([(x >> 3) & 0xFF]))
-        self._command(SET_RAM_Y_ADDRESS_COUNTER, ustruct.pack("<H", y))
+        self.begin()
+        self.add_memory_pointer(x, y)
+        self.send()
         self.wait_until_idle()
 
-    # to wake call reset() or init()
+    def add_memory_pointer(self, x, y):
+        seq = self._seq
+        i = self._reserve(SET_RAM_X_ADDRESS_COUNTER, 1)
+        # x point must be the multiple of 8 or the last 3 bits will be ignored
+        seq[i] = (x >> 3) & 0xFF
+        i = self._reserve(SET_RAM_Y_ADDRESS_COUNTER, 2)
+        seq[i] = y & 0xFF
+        seq[i + 1] = (y >> 8) & 0xFF
+
+    # to wake call wake(), reset() or init()
     def sleep(self):
         self._command(DEEP_SLEEP_MODE)
         self.wait_until_idle()
+        self._deep_sleep = True
+
+    # turn off the analog circuits and clock but stay configured, drawing a
+    # little more current than deep sleep, to wake call init(state)
+    def power_off(self):
+        self.begin()
+        self.add(DISPLAY_UPDATE_CONTROL_2, b'\x03')
+        self.add(MASTER_ACTIVATION)
+        self.send()
+        self.wait_until_idle()
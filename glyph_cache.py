@@ -0,0 +1,123 @@
+"""Cache of rasterized glyph bitmaps for the display buffer."""
+import ustruct
+
+
+class Glyph:
+    """Rasterized glyph, a 1 bit per pixel mask in display buffer layout.
+
+    Each of the rows covers one x position, starting at x0 relative to the
+    text origin, and holds row_bytes of pixels starting at y0, most
+    significant bit first. xmax is the largest x of the glyph strokes, used
+    to detect text running off the display.
+    """
+
+    def __init__(self, x0, y0, rows, row_bytes, xmax, py, bitmap):
+        """Create from the glyph position, size and bitmap."""
+        self.x0 = x0
+        self.y0 = y0
+        self.rows = rows
+        self.row_bytes = row_bytes
+        self.xmax = xmax
+        self.py = py  # last vertex y, the text renderer carries this on
+        self.bitmap = bitmap
+
+    def size(self):
+        """Bytes used by the bitmap and its record in the cache file."""
+        return GlyphCache.RECORD_SIZE + len(self.bitmap)
+
+
+class GlyphCache:
+    """Least recently used cache of rasterized glyphs.
+
+    Glyphs are keyed by (character code, xscale, yscale, pen), the scales
+    in thousandths so keys saved and loaded match exactly. The cache is
+    bounded to max_bytes of bitmaps, evicting the least recently used glyph,
+    and can be saved to flash so glyphs are rasterized once, not every wake.
+    The file holds a key of the font and rasterizer, a cache saved with
+    another key is discarded.
+    """
+
+    RECORD_SIZE = 16
+    _RECORD = '<BHHBhhBBhh'
+    _MAGIC = b'GC2'
+
+    def __init__(self, filename='glyphs.bin', max_bytes=4096, key=b''):
+        """Create the cache, loading glyphs previously saved to filename.
+
+        key is bytes identifying the font and rasterizer the glyphs are
+        rendered with, up to 255 bytes.
+        """
+        self._filename = filename
+        self._key = key
+        self._max_bytes = max_bytes
+        self._glyphs = {}
+        self._order = []
+        self._bytes = 0
+        self._changed = False
+        if filename is not None:
+            self._load()
+
+    def get(self, key):
+        """Get the glyph for key, None if not cached."""
+        glyph = self._glyphs.get(key)
+        if glyph is not None and self._order[-1] != key:
+            self._order.remove(key)
+            self._order.append(key)
+        return glyph
+
+    def put(self, key, glyph):
+        """Add the glyph for key, evicting least recently used glyphs."""
+        self._add(key, glyph)
+        self._changed = True
+
+    def save(self):
+        """Save the cached glyphs if they have changed since loading."""
+        if not self._changed or self._filename is None:
+            return
+        with open(self._filename, 'wb') as cache_file:
+            cache_file.write(self._MAGIC)
+            cache_file.write(bytes([len(self._key)]))
+            cache_file.write(self._key)
+            for key in self._order:
+                glyph = self._glyphs[key]
+                cache_file.write(ustruct.pack(
+                    self._RECORD, *(key + (glyph.x0, glyph.y0, glyph.rows,
+                                           glyph.row_bytes, glyph.xmax,
+                                           glyph.py))))
+                cache_file.write(glyph.bitmap)
+        self._changed = False
+
+    def _add(self, key, glyph):
+        if key in self._glyphs:
+            self._order.remove(key)
+            self._bytes -= self._glyphs[key].size()
+        self._glyphs[key] = glyph
+        self._order.append(key)
+        self._bytes += glyph.size()
+        while self._bytes > self._max_bytes and len(self._order) > 1:
+            oldest = self._order.pop(0)
+            self._bytes -= self._glyphs.pop(oldest).size()
+
+    def _load(self):
+        try:
+            with open(self._filename, 'rb') as cache_file:
+                if cache_file.read(3) != self._MAGIC:
+                    return
+                size = cache_file.read(1)
+                if not size or cache_file.read(size[0]) != self._key:
+                    # Rendered with another font or rasterizer
+                    return
+                while True:
+                    record = cache_file.read(self.RECORD_SIZE)
+                    if len(record) < self.RECORD_SIZE:
+                        break
+                    code, xscale, yscale, pen, x0, y0, rows, row_bytes, \
+                        xmax, py = ustruct.unpack(self._RECORD, record)
+                    bitmap = cache_file.read(rows * row_bytes)
+                    if len(bitmap) < rows * row_bytes:
+                        break
+                    self._add((code, xscale, yscale, pen),
+                              Glyph(x0, y0, rows, row_bytes, xmax, py,
+                                    bitmap))
+        except OSError:
+            pass
@@ -0,0 +1,157 @@
+"""I2C bus shared by the sensor drivers."""
+from machine import I2C
+
+STANDARD = 100000  # Hz
+FAST = 400000  # Hz
+
+_ENODEV = 19  # errno of a NACK, other errors may be the clock
+_READ = 0
+_WRITE = 1
+_COMMAND = 2
+
+
+class Device:
+    """A device on an I2CBus, with register helpers and its I2C cost.
+
+    Reads return a view of a buffer of the bus, valid until its next
+    transaction, so no heap is allocated.
+    """
+
+    def __init__(self, bus, address, freq):
+        """Create for the address at the highest clock it supports."""
+        self._bus = bus
+        self.address = address
+        self.freq = freq
+        self.transactions = 0
+        self.bytes = 0  # register addresses and data
+        self.retries = 0
+
+    def present(self):
+        """Check the device acknowledges its address."""
+        return self.address in self._bus.scan()
+
+    def read(self, register, size):
+        """Read size bytes from register, as a view of a bus buffer."""
+        data = self._bus.read_buffer(size)
+        self._bus.transfer(self, _READ, register, data)
+        return data
+
+    def read_into(self, register, buffer):
+        """Read from register into the buffer."""
+        self._bus.transfer(self, _READ, register, buffer)
+
+    def read_u8(self, register):
+        """Read the byte of register."""
+        return self.read(register, 1)[0]
+
+    def buffer(self, size):
+        """Buffer of the bus to fill with size bytes to write."""
+        return self._bus.write_buffer(size)
+
+    def write(self, register, data):
+        """Write data to register."""
+        self._bus.transfer(self, _WRITE, register, data)
+
+    def write_u8(self, register, value):
+        """Write the byte value to register."""
+        data = self._bus.write_buffer(1)
+        data[0] = value
+        self._bus.transfer(self, _WRITE, register, data)
+
+    def command(self, register):
+        """Write only the register address, e.g. to start an operation."""
+        data = self._bus.write_buffer(1)
+        data[0] = register
+        self._bus.transfer(self, _COMMAND, register, data)
+
+
+class I2CBus:
+    """I2C bus shared by the sensor drivers.
+
+    The clock is set for each device, starting at the highest it supports
+    and dropping to the standard clock if it fails there. Failed
+    transactions are retried, and each device counts its transactions and
+    bytes so the I2C cost of a wake can be reported.
+    """
+
+    _READ_SIZE = 32
+    _WRITE_SIZE = 8
+
+    def __init__(self, scl, sda, retries=2):
+        """Create on the scl and sda Pins, retrying failures retries times."""
+        self._scl = scl
+        self._sda = sda
+        self._retries = retries
+        self._freq = FAST
+        self._i2c = I2C(scl=scl, sda=sda, freq=FAST)
+        self._devices = {}
+        # Views of every size, slicing a memoryview allocates
+        read = memoryview(bytearray(self._READ_SIZE))
+        self._reads = [read[:size] for size in range(self._READ_SIZE + 1)]
+        write = memoryview(bytearray(self._WRITE_SIZE))
+        self._writes = [write[:size] for size in range(self._WRITE_SIZE + 1)]
+
+    @property
+    def devices(self):
+        """Devices used, by address."""
+        return sorted(self._devices.values(), key=lambda d: d.address)
+
+    def device(self, address, freq=FAST):
+        """Device at address, freq is the highest clock it supports.
+
+        The same Device is returned for each call with the address.
+        """
+        device = self._devices.get(address)
+        if device is None:
+            device = Device(self, address, freq)
+            self._devices[address] = device
+        return device
+
+    def scan(self):
+        """Addresses of the devices that acknowledge."""
+        return self._i2c.scan()
+
+    def read_buffer(self, size):
+        """View of size bytes of the read buffer."""
+        if size > self._READ_SIZE:
+            raise ValueError('I2C read of %d bytes' % size)
+        return self._reads[size]
+
+    def write_buffer(self, size):
+        """View of size bytes of the write buffer."""
+        if size > self._WRITE_SIZE:
+            raise ValueError('I2C write of %d bytes' % size)
+        return self._writes[size]
+
+    def transfer(self, device, operation, register, data):
+        """Read or write data for device, retrying failures."""
+        attempts = self._retries
+        while True:
+            self._clock(device.freq)
+            try:
+                if operation == _READ:
+                    self._i2c.readfrom_mem_into(device.address, register,
+                                                data)
+                elif operation == _WRITE:
+                    self._i2c.writeto_mem(device.address, register, data)
+                else:
+                    self._i2c.writeto(device.address, data)
+            except OSError as e:
+                if attempts == 0:
+                    if e.args[0] == _ENODEV or device.freq <= STANDARD:
+                        raise
+                    # Not a NACK, the device may not keep up with the clock
+                    device.freq = STANDARD
+                    attempts = self._retries
+                else:
+                    attempts -= 1
+                device.retries += 1
+                continue
+            device.transactions += 1
+            device.bytes += len(data) + (operation != _COMMAND)
+            return
+
+    def _clock(self, freq):
+        if freq != self._freq:
+            self._i2c.init(scl=self._scl, sda=self._sda, freq=freq)
+            self._freq = freq
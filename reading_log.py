@@ -0,0 +1,170 @@
+"""Log of the readings in flash, written in batches."""
+import uio
+import uos
+import ustruct
+
+# Record flags
+FLAG_BASELINE = 0x01  # ccs811 baseline loaded
+FLAG_POWER_ON = 0x02  # first reading after power on
+
+NONE = 0xffff  # no eCO2 or TVOC value
+
+# Timestamp (utime.time()), C * 100, %RH * 100, eCO2 ppm, TVOC ppb, mV,
+# flags
+RECORD = '<IhHHHHBx'
+RECORD_SIZE = 16
+
+
+class ReadingLog:
+    """Log of the readings in flash, written in batches.
+
+    Readings are kept in the state, as bytes that can be held in RTC
+    memory during deep sleep, until a batch is written. The log is a ring
+    of segment files, each with a header of its sequence number, written
+    in turn so the flash used is bounded and its wear spread over the
+    segments. When one is full the oldest is replaced.
+    """
+
+    _STATE = '<BIHB'  # segment, its sequence number and records, pending
+    _STATE_SIZE = 8
+    _HEADER = '<4sII4x'  # magic, sequence number, record size
+    _HEADER_SIZE = 16
+    _MAGIC = b'AQLG'
+
+    def __init__(self, directory, batch, segments, segment_records,
+                 state=None):
+        """Create for the log in directory.
+
+        batch is the number of readings written together, segments the
+        number of files of segment_records readings in the ring. state is
+        bytes from the state property of a previous wake, None if not
+        known.
+        """
+        self._directory = directory
+        self._batch = batch
+        self._segments = segments
+        self._segment_records = segment_records
+        self._state = bytearray(self.state_size(batch))
+        if state is not None and len(state) == len(self._state):
+            self._state[:] = state
+        # sequence 0 when the segment is not known
+        self._segment, self._sequence, self._records, self._pending = \
+            ustruct.unpack(self._STATE, self._state)
+
+    @classmethod
+    def state_size(cls, batch):
+        """Size of the state for batches of batch readings."""
+        return cls._STATE_SIZE + batch * RECORD_SIZE
+
+    @property
+    def state(self):
+        """State to pass to the next ReadingLog, as bytes."""
+        ustruct.pack_into(self._STATE, self._state, 0, self._segment,
+                          self._sequence, self._records, self._pending)
+        return bytes(self._state)
+
+    def append(self, timestamp, temperature, humidity, co2, voc, volts,
+               flags=0):
+        """Add a reading, writing the batch when it is complete.
+
+        co2 and voc are None when there is no value. Returns the number of
+        readings written to flash.
+        """
+        if self._pending >= self._batch:
+            # The last write failed
+            self.flush()
+        ustruct.pack_into(
+            RECORD, self._state,
+            self._STATE_SIZE + self._pending * RECORD_SIZE, timestamp,
+            int(round(temperature * 100)), int(round(humidity * 100)),
+            NONE if co2 is None else co2, NONE if voc is None else voc,
+            int(round(volts * 1000)), flags)
+        self._pending += 1
+        if self._pending < self._batch:
+            return 0
+        return self.flush()
+
+    def flush(self):
+        """Write the pending readings, returns how many were written."""
+        count = self._pending
+        if count == 0:
+            return 0
+        data = memoryview(self._state)[self._STATE_SIZE:
+                                       self._STATE_SIZE + count * RECORD_SIZE]
+        try:
+            if self._sequence == 0:
+                self._find_segment()
+            while data:
+                if self._records >= self._segment_records:
+                    self._next_segment()
+                size = min(len(data), (self._segment_records -
+                                       self._records) * RECORD_SIZE)
+                with uio.open(self._path(self._segment), 'ab') as segment:
+                    segment.write(data[:size])
+                self._records += size // RECORD_SIZE
+                data = data[size:]
+        except OSError:
+            # Find the segment again at the next write
+            self._sequence = 0
+            raise
+        self._pending = 0
+        return count
+
+    def records(self):
+        """Yield the readings, oldest first, as tuples in RECORD order."""
+        for sequence, index in sorted(self._headers()):
+            with uio.open(self._path(index), 'rb') as segment:
+                segment.seek(self._HEADER_SIZE)
+                while True:
+                    data = segment.read(RECORD_SIZE)
+                    if len(data) < RECORD_SIZE:
+                        break
+                    yield ustruct.unpack(RECORD, data)
+        for i in range(self._pending):
+            yield ustruct.unpack_from(
+                RECORD, self._state, self._STATE_SIZE + i * RECORD_SIZE)
+
+    def _path(self, index):
+        return '%s/%d.bin' % (self._directory, index)
+
+    def _headers(self):
+        # (sequence number, index) of each valid segment
+        headers = []
+        for index in range(self._segments):
+            try:
+                with uio.open(self._path(index), 'rb') as segment:
+                    header = segment.read(self._HEADER_SIZE)
+            except OSError:
+                continue
+            if len(header) == self._HEADER_SIZE:
+                magic, sequence, size = ustruct.unpack(self._HEADER, header)
+                if magic == self._MAGIC and size == RECORD_SIZE:
+                    headers.append((sequence, index))
+        return headers
+
+    def _find_segment(self):
+        # The state was lost, continue the newest segment if it ends with
+        # a whole record, otherwise start the next one
+        headers = self._headers()
+        if not headers:
+            try:
+                uos.mkdir(self._directory)
+            except OSError:
+                pass
+            self._segment = self._segments - 1
+            self._records = self._segment_records
+            return
+        self._sequence, self._segment = max(headers)
+        size = uos.stat(self._path(self._segment))[6] - self._HEADER_SIZE
+        self._records = size // RECORD_SIZE
+        if size % RECORD_SIZE:
+            self._records = self._segment_records
+
+    def _next_segment(self):
+        # Replace the oldest segment
+        self._segment = (self._segment + 1) % self._segments
+        self._sequence += 1
+        self._records = 0
+        with uio.open(self._path(self._segment), 'wb') as segment:
+            segment.write(ustruct.pack(self._HEADER, self._MAGIC,
+                                       self._sequence, RECORD_SIZE))
@@ -0,0 +1,82 @@
+"""Schedules full refreshes of the e-paper display."""
+import ustruct
+
+
+class Refresh:
+    """Schedules full refreshes of the e-paper display.
+
+    Partial updates are quick but leave ghosting that builds up with the
+    number of updates and the area they change. A full refresh clears it,
+    so one is due when either budget is used up since the last one, or
+    once a day at a quiet hour. The counts are kept as bytes so they can
+    be held in RTC memory during deep sleep.
+    """
+
+    STATE_SIZE = 8
+    _STATE = '<HIH'
+    _NO_DAY = 0xffff
+
+    def __init__(self, max_partial, max_pixels, quiet_hour=None, state=None):
+        """Create with the budgets and the state from a previous wake.
+
+        max_partial is the number of partial updates and max_pixels the
+        number of pixels they change before a full refresh is due.
+        quiet_hour is the hour of the day of a full refresh, None for no
+        daily refresh, it needs the RTC to have been set. state is bytes
+        from the state property, None if not known.
+        """
+        self._max_partial = max_partial
+        self._max_pixels = max_pixels
+        self._quiet_hour = quiet_hour
+        self._partial_count = 0
+        self._changed_pixels = 0
+        self._quiet_day = self._NO_DAY
+        if state is not None and len(state) == self.STATE_SIZE:
+            self._partial_count, self._changed_pixels, self._quiet_day = \
+                ustruct.unpack(self._STATE, state)
+
+    @property
+    def partial_count(self):
+        """Partial updates since the last full refresh."""
+        return self._partial_count
+
+    @property
+    def changed_pixels(self):
+        """Pixels changed by partial updates since the last full refresh."""
+        return self._changed_pixels
+
+    @property
+    def state(self):
+        """State to pass to the next Refresh, as bytes."""
+        return ustruct.pack(self._STATE, self._partial_count,
+                            self._changed_pixels, self._quiet_day)
+
+    def full_refresh_due(self, localtime):
+        """Check if the next update should be a full refresh.
+
+        localtime is the current time as returned by utime.localtime().
+        """
+        if self._partial_count == 0:
+            return False
+        if self._partial_count >= self._max_partial or \
+                self._changed_pixels >= self._max_pixels:
+            return True
+        return self._quiet_hour is not None and \
+            localtime[3] == self._quiet_hour and \
+            localtime[7] != self._quiet_day
+
+    def updated(self, full, pixels, localtime):
+        """Record an update of the display.
+
+        full is True for a full refresh, pixels is the number of pixels a
+        partial update sent.
+        """
+        if full:
+            self._partial_count = 0
+            self._changed_pixels = 0
+            if localtime[3] == self._quiet_hour:
+                self._quiet_day = localtime[7]
+        elif pixels:
+            self._partial_count = min(self._partial_count + 1, 0xffff)
+            self._changed_pixels = min(self._changed_pixels + pixels,
+                                       0xffffffff)
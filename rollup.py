@@ -0,0 +1,201 @@
+"""Minimum, maximum and mean of the readings over periods of time."""
+import uio
+import uos
+import ustruct
+
+# Channels, in the units of reading_log records
+TEMPERATURE = 0  # C * 100
+HUMIDITY = 1  # %RH * 100
+CO2 = 2  # ppm
+VOC = 3  # ppb
+MILLIVOLTS = 4
+
+# Bucket start time, the minimum, maximum and sum of each channel, the
+# number of readings and the number with eCO2 and TVOC
+_BUCKET = '<IhhiHHIHHIHHIHHIHH'
+_BUCKET_SIZE = 48
+_EMPTY = (0, 32767, -32768, 0) + (65535, 0, 0) * 4 + (0, 0)
+_COUNT = 16
+_GAS_COUNT = 17
+
+
+class Rollup:
+    """Minimum, maximum and mean of the readings over periods of time.
+
+    Readings are summarised in buckets of each period, such as 10
+    minutes, an hour and a day. The open bucket of each period is kept in
+    the state, as bytes that can be held in RTC memory during deep sleep,
+    and written to the ring file of its period when the next bucket
+    starts, so the files are only written once per bucket. A query uses
+    the longest periods that fit the window, reading few buckets.
+
+    Buckets are by utime.time(), so the RTC time must be set, for example
+    by NTP. Otherwise it restarts at 2000-01-01 on power on and buckets
+    from before are read as recent.
+    """
+
+    def __init__(self, directory, periods, state=None):
+        """Create for the files in directory.
+
+        periods is a tuple of (seconds, buckets kept) from the shortest
+        period, each a multiple of the one before. state is bytes from
+        the state property of a previous wake, None if not known.
+        """
+        self._directory = directory
+        self._periods = periods
+        self._open = [list(_EMPTY) for _ in periods]
+        if state is not None and len(state) == self.state_size(periods):
+            for level in range(len(periods)):
+                self._open[level] = list(ustruct.unpack_from(
+                    _BUCKET, state, level * _BUCKET_SIZE))
+
+    @staticmethod
+    def state_size(periods):
+        """Size of the state for the periods."""
+        return len(periods) * _BUCKET_SIZE
+
+    @property
+    def state(self):
+        """State to pass to the next Rollup, as bytes."""
+        return b''.join(ustruct.pack(_BUCKET, *bucket)
+                        for bucket in self._open)
+
+    def add(self, timestamp, temperature, humidity, co2, voc, volts):
+        """Add a reading, co2 and voc are None when there is no value."""
+        values = (int(round(temperature * 100)), int(round(humidity * 100)),
+                  co2, voc, int(round(volts * 1000)))
+        for level, (seconds, _) in enumerate(self._periods):
+            bucket = self._open[level]
+            start = timestamp - timestamp % seconds
+            if bucket[0] != start:
+                if bucket[_COUNT]:
+                    self._write(level, bucket)
+                bucket = list(_EMPTY)
+                bucket[0] = start
+                self._open[level] = bucket
+            for channel, value in enumerate(values):
+                if value is None:
+                    continue
+                i = 1 + channel * 3
+                if value < bucket[i]:
+                    bucket[i] = value
+                if value > bucket[i + 1]:
+                    bucket[i + 1] = value
+                bucket[i + 2] += value
+            bucket[_COUNT] += 1
+            if co2 is not None:
+                bucket[_GAS_COUNT] += 1
+
+    def query(self, start, end, channel):
+        """Minimum, maximum and mean of channel from start to end.
+
+        start and end are times as from utime.time(), rounded out to the
+        shortest period. Where the shorter period buckets of the window are
+        no longer kept, the longer bucket enclosing them is used instead,
+        so readings up to that period outside the window can be included.
+        Returns None if there are no readings.
+        """
+        seconds = self._periods[0][0]
+        start -= start % seconds
+        end += -end % seconds
+        total = [0, None, None, 0]  # count, minimum, maximum, sum
+        self._query(len(self._periods) - 1, start, end, channel, total)
+        if total[0] == 0:
+            return None
+        return total[1], total[2], total[3] / total[0]
+
+    def _query(self, level, start, end, channel, total):
+        # Cover start to end with the buckets of level and shorter periods
+        if start >= end:
+            return
+        seconds = self._periods[level][0]
+        if level > 0:
+            # Round out to this period where the shorter period buckets of
+            # an edge have aged out of their ring
+            kept_from = self._kept_from(level - 1)
+            if start < kept_from:
+                start -= start % seconds
+            if end - end % seconds < kept_from:
+                end += -end % seconds
+        first = start + -start % seconds
+        last = end - end % seconds
+        if level > 0:
+            if first >= last:
+                self._query(level - 1, start, end, channel, total)
+                return
+            self._query(level - 1, start, first, channel, total)
+            self._query(level - 1, last, end, channel, total)
+            start = first
+            end = last
+        open_bucket = self._open[level]
+        path = self._path(level)
+        try:
+            size = uos.stat(path)[6]
+            file = uio.open(path, 'rb')
+        except OSError:
+            size = 0
+            file = None
+        try:
+            for bucket_start in range(start, end, seconds):
+                if bucket_start == open_bucket[0]:
+                    bucket = open_bucket
+                else:
+                    offset = self._offset(level, bucket_start)
+                    if offset + _BUCKET_SIZE > size:
+                        continue
+                    file.seek(offset)
+                    bucket = ustruct.unpack(_BUCKET, file.read(_BUCKET_SIZE))
+                    if bucket[0] != bucket_start:
+                        continue
+                _merge(bucket, channel, total)
+        finally:
+            if file is not None:
+                file.close()
+
+    def _kept_from(self, level):
+        # Start of the oldest bucket of level still in its ring
+        seconds, kept = self._periods[level]
+        return self._open[level][0] - (kept - 1) * seconds
+
+    def _path(self, level):
+        return '%s/%d.bin' % (self._directory, self._periods[level][0])
+
+    def _offset(self, level, start):
+        seconds, kept = self._periods[level]
+        return start // seconds % kept * _BUCKET_SIZE
+
+    def _write(self, level, bucket):
+        # Into the bucket's slot of the ring, the file grows to it the first
+        # time round
+        path = self._path(level)
+        offset = self._offset(level, bucket[0])
+        try:
+            size = uos.stat(path)[6]
+        except OSError:
+            try:
+                uos.mkdir(self._directory)
+            except OSError:
+                pass
+            size = 0
+        with uio.open(path, 'r+b' if size else 'wb') as file:
+            if size < offset:
+                file.seek(size)
+                zeros = bytes(_BUCKET_SIZE * 8)
+                while size < offset:
+                    size += file.write(zeros[:min(len(zeros), offset - size)])
+            file.seek(offset)
+            file.write(ustruct.pack(_BUCKET, *bucket))
+
+
+def _merge(bucket, channel, total):
+    # Add the channel of the bucket to the total
+    count = bucket[_GAS_COUNT] if channel in (CO2, VOC) else bucket[_COUNT]
+    if count == 0:
+        return
+    i = 1 + channel * 3
+    if total[1] is None or bucket[i] < total[1]:
+        total[1] = bucket[i]
+    if total[2] is None or bucket[i + 1] > total[2]:
+        total[2] = bucket[i + 1]
+    total[3] += bucket[i + 2]
+    total[0] += count
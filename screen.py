@@ -1,11 +1,31 @@
 """Air quality monitor screen."""
 import epaper2in9
-from machine import SPI
+import ubinascii
+import ustruct
+import screen_texts
+from machine import Pin, SPI
 from display_buffer import Buffer
+from glyph_cache import GlyphCache
+from vector_font import Font
+
+# Bits set in each byte value
+_BITS = bytes(bin(i).count('1') for i in range(256))
 
 
 class Screen:
-    """Air quality monitor screen."""
+    """Air quality monitor screen.
+
+    Each reading is shown in a field. When the text currently shown on the
+    display is known, only the fields whose text has changed are sent to
+    the display memory. The borders and titles never change, they are
+    rendered once into a template kept in flash, keyed by the layout, font
+    and rasterizer.
+
+    With a trend.Trend, its graph is drawn in the TVOC quadrant above a
+    smaller TVOC value. Each column is a vertical span from the previous
+    column's level, and only the columns changed since the graph was last
+    drawn are sent to the display.
+    """
 
     # Text size scales
     _TINY_TEXT = 0.3
@@ -14,79 +34,285 @@ class Screen:
     # Screen
     _HALF_WIDTH = int(epaper2in9.EPD_WIDTH / 2)
     _HALF_HEIGHT = int(epaper2in9.EPD_HEIGHT / 2)
+    # Static layout, the template is rebuilt when this changes
+    _BORDERS = ((0, _HALF_WIDTH, epaper2in9.EPD_HEIGHT, _HALF_WIDTH),
+                (_HALF_HEIGHT, 0, _HALF_HEIGHT, epaper2in9.EPD_WIDTH))
+    _TITLES = (("Temperature", 2, 113), ("Humidity", 152, 113),
+               ("eCO2 ppm", 2, 48), ("TVOC ppb", 152, 48))
+    _TEMPLATE_FILE = 'screen_template.bin'
+    # Fields, in the order of the shown texts
+    _TEMPERATURE = 0
+    _HUMIDITY = 1
+    _CO2 = 2
+    _VOC = 3
+    _VOLTAGE = 4
+    _BASELINE = 5
+    # (x, y, w, h) rectangle each field's text is drawn within, including
+    # the longest values (32768ppm/ppb)
+    _FIELD_BOXES = ((0, 66, 148, 41), (150, 66, 146, 41),
+                    (0, 0, 165, 43), (150, 0, 146, 43),
+                    (272, 118, 24, 10), (287, 0, 9, 13))
+    # With a trend, the TVOC field and the (x, y, columns, rows) of its
+    # graph, labelled in the template
+    _SMALL_VOC_BOX = (150, 0, 80, 20)
+    _GRAPH = (152, 24, 144, 16)
+    _GRAPH_LABEL = (230, 6)
+
+    def __init__(self, config, shown=None, epd_state=0):
+        """Create with the supplied configuration.
+
+        shown is the tuple of field texts currently on the display, as
+        returned by the shown property after the previous update, or None
+        if not known. epd_state is the display controller state returned by
+        the epd_state property after the previous sleep, 0 if not known.
+        """
+        spi = SPI(-1, baudrate=config.baudrate, sck=Pin(config.sck),
+                  mosi=Pin(config.mosi), miso=Pin(config.miso))
+        self._epd = epaper2in9.EPD(spi, Pin(config.cs), Pin(config.dc),
+                                   Pin(config.rst1), Pin(config.busy),
+                                   config.epd_light_sleep)
+        self._epd.init(epd_state)
+        self._deep_sleep = config.epd_deep_sleep
+        font = Font()
+        # What is rendered, saved rendering from another font or
+        # rasterizer is not reused
+        self._render_key = ustruct.pack('<IB', font.crc, Buffer.RENDERER)
+        self._glyphs = GlyphCache(key=self._render_key)
+        self._buffer = Buffer(epaper2in9.EPD_WIDTH, epaper2in9.EPD_HEIGHT,
+                              font, self._glyphs)
+        self._shown = shown
+        self._trend = None
+        self._bytes_sent = 0
+        self._transactions = 0
+        self._changed_pixels = 0
+
+    @property
+    def shown(self):
+        """Tuple of field texts currently on the display."""
+        return self._shown
+
+    @property
+    def bytes_sent(self):
+        """Bytes sent to the display by the last update."""
+        return self._bytes_sent
+
+    @property
+    def transactions(self):
+        """SPI transactions (CS assertions) made by the last update."""
+        return self._transactions
+
+    @property
+    def frame(self):
+        """The whole frame as last rendered, in display memory layout."""
+        return self._buffer.get()
 
-    def __init__(self, config):
-        """Create with the supplied configuration."""
-        spi = SPI(-1, baudrate=config.baudrate,
-                  sck=config.sck, mosi=config.mosi, miso=config.miso)
-        self._epd = epaper2in9.EPD(spi, config.cs, config.dc,
-                                   config.rst1, config.busy)
-        self._epd.init()
-        self._buffer = Buffer(epaper2in9.EPD_WIDTH, epaper2in9.EPD_HEIGHT)
+    @property
+    def changed_pixels(self):
+        """Pixels the last update changed on the display.
+
+        Pixels of the changed graph columns and, when what was shown is not
+        known, of every window sent are all counted.
+        """
+        return self._changed_pixels
+
+    @property
+    def epd_state(self):
+        """Display controller state to pass to the next Screen."""
+        return self._epd.state
+
+    @property
+    def busy_ms(self):
+        """Dictionary of display command to milliseconds it was busy for."""
+        return self._epd.busy_ms
 
     def update(self, temperature, humidity, co2, voc, voltage,
-               baseline=False, fullupdate=False):
-        """Update the screen with the supplied readings."""
-        self._add_borders()
-        self._add_temperature(temperature)
-        self._add_humidity(humidity)
-        self._add_co2(co2)
-        self._add_voc(voc)
-        self._add_voltage(voltage)
-        self._add_baseline_indicator(baseline)
+               baseline=False, fullupdate=False, trend=None):
+        """Update the screen with the supplied readings.
+
+        trend is a trend.Trend to graph, None for no graph. Its columns are
+        recorded as drawn.
+        """
+        texts = screen_texts.texts(temperature, humidity, co2, voc, voltage,
+                                   baseline)
+        shown = None if fullupdate else self._shown
+        self._trend = trend
+
+        self._add_template()
+        changed = []
+        for field in range(len(texts)):
+            if shown is not None and texts[field] == shown[field]:
+                self._add_field(field, texts[field])
+            else:
+                changed.append(field)
+        if trend is not None:
+            self._add_graph()
+        graph_pixels = 0
+        if shown is not None:
+            # Only send the fields and columns that differ from the display
+            self._buffer.clear_dirty()
+            if trend is not None:
+                x, y, columns, rows = self._GRAPH
+                for column in trend.changed():
+                    if column < columns:
+                        self._buffer.mark_dirty(x + column, y, 1, rows)
+                        graph_pixels += rows
+        for field in changed:
+            self._buffer.mark_dirty(*self._field_box(field))
+        windows = self._buffer.dirty_rects()
+        if shown is not None:
+            # Render the changed fields as shown to count the pixels that
+            # change, then restore the windows without them
+            frame = self._buffer.get()
+            common = _window_bytes(frame, windows)
+            for field in changed:
+                self._add_field(field, shown[field])
+            old = _window_bytes(frame, windows)
+            _put_window_bytes(frame, windows, common)
+        for field in changed:
+            self._add_field(field, texts[field])
+        if shown is None:
+            self._changed_pixels = 0
+            for x, y, w, h in windows:
+                self._changed_pixels += w * h
+        else:
+            new = _window_bytes(self._buffer.get(), windows)
+            self._changed_pixels = graph_pixels
+            for i in range(len(new)):
+                self._changed_pixels += _BITS[old[i] ^ new[i]]
+
         self._update_screen(fullupdate)
+        self._glyphs.save()
+        self._shown = texts
+        if trend is not None:
+            trend.drawn()
 
     def sleep(self):
         """Put the screen into low current mode."""
-        self._epd.sleep()
+        if self._deep_sleep:
+            self._epd.sleep()
+        else:
+            self._epd.power_off()
+
+    def _field_box(self, field):
+        if field == self._VOC and self._trend is not None:
+            return self._SMALL_VOC_BOX
+        return self._FIELD_BOXES[field]
+
+    def _add_field(self, field, text):
+        if field == self._TEMPERATURE:
+            self._write_value_text(text, 5, 70)
+        elif field == self._HUMIDITY:
+            self._write_value_text(text, 158, 70)
+        elif field == self._CO2:
+            self._add_co2(text)
+        elif field == self._VOC:
+            self._add_voc(text)
+        elif field == self._VOLTAGE:
+            self._add_voltage(text)
+        elif field == self._BASELINE:
+            self._add_baseline_indicator(text)
+
+    def _add_template(self):
+        label = self._graph_label()
+        key = self._render_key + ustruct.pack('<I', ubinascii.crc32(repr(
+            (self._BORDERS, self._TITLES, self._SMALL_TEXT, label,
+             self._GRAPH_LABEL)).encode()))
+        try:
+            with open(self._TEMPLATE_FILE, 'rb') as template:
+                if template.read(len(key)) == key and \
+                        self._buffer.read_from(template):
+                    return
+        except OSError:
+            pass
+        # Missing or out of date, render and save it
+        self._add_borders()
+        self._add_titles()
+        if label is not None:
+            x, y = self._GRAPH_LABEL
+            self._write_text(label, x, y, self._TINY_TEXT,
+                             self._buffer.PEN_THIN)
+        try:
+            with open(self._TEMPLATE_FILE, 'wb') as template:
+                template.write(key)
+                template.write(self._buffer.get())
+        except OSError:
+            pass
+
+    def _graph_label(self):
+        # The time the graph spans, None without a graph
+        if self._trend is None:
+            return None
+        minutes = self._trend.columns * self._trend.period // 60
+        if minutes % 60:
+            return 'eCO2 %dm' % minutes
+        return 'eCO2 %dh' % (minutes // 60)
+
+    def _add_graph(self):
+        # A span from the previous column's level to each column's, the
+        # first column and those after a blank one are a single row
+        x, y, columns, rows = self._GRAPH
+        buffer = self._buffer
+        trend = self._trend
+        scale = trend.LEVELS - 1
+        previous = None
+        for column in range(min(columns, trend.columns)):
+            level = trend.level(column)
+            if level == 0:
+                previous = None
+                continue
+            row = (level - 1) * (rows - 1) // scale
+            if previous is None:
+                previous = row
+            # y is up the display
+            buffer.vline(x + column, y + min(row, previous),
+                         abs(row - previous) + 1, buffer.BLACK)
+            previous = row
 
     def _add_borders(self):
         self._buffer.background(self._buffer.WHITE)
-        self._add_line(0, self._HALF_WIDTH,
-                       epaper2in9.EPD_HEIGHT, self._HALF_WIDTH)
-        self._add_line(self._HALF_HEIGHT, 0,
-                       self._HALF_HEIGHT, epaper2in9.EPD_WIDTH)
+        for x1, y1, x2, y2 in self._BORDERS:
+            self._add_line(x1, y1, x2, y2)
+
+    def _add_titles(self):
+        for text, x, y in self._TITLES:
+            self._write_title_text(text, x, y)
 
     def _add_line(self, x1, y1, x2, y2):
         self._buffer.line(x1, y1, x2, y2,
                           self._buffer.BLACK, self._buffer.PEN_MEDIUM)
 
-    def _add_temperature(self, temperature):
-        self._write_title_text("Temperature", 2, 113)
-        self._write_value_text("%dC" % int(round(temperature)), 5, 70)
-
-    def _add_humidity(self, humidity):
-        self._write_title_text("Humidity", 152, 113)
-        self._write_value_text("%d%%" % int(round(humidity)), 158, 70)
-
     def _add_co2(self, co2):
         # 400ppm to 32768ppm
-        self._write_title_text("eCO2 ppm", 2, 48)
-        if co2 is None:
+        if co2 == "":
             self._add_line(50, 25, 80, 25)
         else:
-            self._write_value_text("%d" % co2, 10, 5)
+            self._write_value_text(co2, 10, 5)
 
     def _add_voc(self, voc):
         # 0ppb to 32768ppb
-        self._write_title_text("TVOC ppb", 152, 48)
-        if voc is None:
+        if self._trend is not None:
+            # Below the graph
+            if voc == "":
+                self._add_line(160, 10, 190, 10)
+            else:
+                self._write_title_text(voc, 158, 3)
+        elif voc == "":
             self._add_line(200, 25, 230, 25)
         else:
-            self._write_value_text("%d" % voc, 158, 5)
+            self._write_value_text(voc, 158, 5)
 
     def _add_voltage(self, voltage):
-        if voltage is not None:
+        if voltage != "":
             self._buffer.line(272, 118, 272, epaper2in9.EPD_WIDTH,
                               self._buffer.BLACK, self._buffer.PEN_THIN)
             self._buffer.line(272, 118, epaper2in9.EPD_HEIGHT, 118,
                               self._buffer.BLACK, self._buffer.PEN_THIN)
-            self._write_text("%.1fV" % voltage, 274, 120, self._TINY_TEXT,
+            self._write_text(voltage, 274, 120, self._TINY_TEXT,
                              self._buffer.PEN_THIN)
 
     def _add_baseline_indicator(self, baseline):
-        if baseline:
-            self._write_text("B", 288, 2, self._TINY_TEXT,
+        if baseline != "":
+            self._write_text(baseline, 288, 2, self._TINY_TEXT,
                              self._buffer.PEN_THIN)
 
     def _write_title_text(self, text, x, y):
@@ -100,10 +326,65 @@ class Screen:
                                 scale, scale, None, pen)
 
     def _update_screen(self, fullupdate):
-        if fullupdate:
-            self._epd.set_lut(self._epd.LUT_FULL_UPDATE)
+        # Windows rely on the display memory keeping the rest of the
+        # previous frame, a full update always sends the whole frame. The
+        # LUT, frame memory and refresh are sent as one command sequence.
+        # The controller has two RAM banks and writes to the other after
+        # each refresh, so the frame memory is then written again to keep
+        # both banks holding this frame.
+        epd = self._epd
+        sent = epd.bytes_sent
+        transactions = epd.transactions
+        windows = self._buffer.dirty_rects()
+        if windows:
+            epd.begin()
+            if fullupdate:
+                epd.add_lut(epd.LUT_FULL_UPDATE)
+            else:
+                epd.add_lut(epd.LUT_PARTIAL_UPDATE)
+            if fullupdate:
+                windows = [(0, 0, epaper2in9.EPD_WIDTH,
+                            epaper2in9.EPD_HEIGHT)]
+            self._add_frame(windows)
+            epd.add_display_frame()
+            epd.send()
+            epd.wait_until_idle()
+            epd.begin()
+            self._add_frame(windows)
+            epd.send()
+        self._buffer.clear_dirty()
+        self._bytes_sent = epd.bytes_sent - sent
+        self._transactions = epd.transactions - transactions
+
+    def _add_frame(self, windows):
+        # The frame memory of the windows
+        epd = self._epd
+        if windows == [(0, 0, epaper2in9.EPD_WIDTH, epaper2in9.EPD_HEIGHT)]:
+            epd.add_frame_memory(self._buffer.get(), 0, 0,
+                                 epaper2in9.EPD_WIDTH, epaper2in9.EPD_HEIGHT)
         else:
-            self._epd.set_lut(self._epd.LUT_PARTIAL_UPDATE)
-        self._epd.set_frame_memory(self._buffer.get(), 0, 0,
-                                   epaper2in9.EPD_WIDTH, epaper2in9.EPD_HEIGHT)
-        self._epd.display_frame()
+            for x, y, w, h in windows:
+                epd.add_frame_window(self._buffer.get(), x, y, w, h)
+
+
+def _window_bytes(frame, windows):
+    # The bytes of the windows of the frame, a row of each at a time
+    stride = epaper2in9.EPD_WIDTH // 8
+    data = bytearray()
+    for x, y, w, h in windows:
+        for row in range(y, y + h):
+            start = row * stride + (x >> 3)
+            data += frame[start:start + (w >> 3)]
+    return data
+
+
+def _put_window_bytes(frame, windows, data):
+    # Write back bytes of the windows from _window_bytes()
+    stride = epaper2in9.EPD_WIDTH // 8
+    i = 0
+    for x, y, w, h in windows:
+        size = w >> 3
+        for row in range(y, y + h):
+            start = row * stride + (x >> 3)
+            frame[start:start + size] = data[i:i + size]
+            i += size
@@ -0,0 +1,15 @@
+"""Texts of the air quality monitor screen fields.
+
+Kept apart from screen.py so a wake can tell whether the display would
+change without importing the display modules.
+"""
+
+
+def texts(temperature, humidity, co2, voc, voltage, baseline):
+    """Tuple of the text of each field, empty if there is no value."""
+    return ("%dC" % int(round(temperature)),
+            "%d%%" % int(round(humidity)),
+            "" if co2 is None else "%d" % co2,
+            "" if voc is None else "%d" % voc,
+            "" if voltage is None else "%.1fV" % voltage,
+            "B" if baseline else "")
@@ -0,0 +1,75 @@
+"""State kept in RTC memory while the esp32 is in deep sleep."""
+import ubinascii
+import ustruct
+
+
+class State:
+    """Named fields packed in one record of RTC memory.
+
+    Subsystems add their fields before the record is loaded, once at a
+    wake, and it is saved once before deep sleep. The record has a version
+    and size, changed when the fields change, and a CRC32; when they do not
+    match, as after power on, the fields are all zero.
+    """
+
+    _HEADER = '<BH'  # version, size of the fields
+    _HEADER_SIZE = 3
+    _CRC_SIZE = 4
+
+    def __init__(self, rtc, version):
+        """Create for the machine.RTC and the version of the fields."""
+        self._rtc = rtc
+        self._version = version
+        self._fields = {}
+        self._size = 0
+        self._data = None
+        self._loaded = False
+        self._changed = False
+
+    def add(self, name, fmt):
+        """Add a field of the ustruct format, of one value, before load()."""
+        if self._data is not None:
+            raise ValueError('State already loaded')
+        self._fields[name] = (self._size, fmt)
+        self._size += ustruct.calcsize(fmt)
+
+    @property
+    def loaded(self):
+        """True if the fields were loaded, False if they are zero."""
+        return self._loaded
+
+    def load(self):
+        """Read the record from RTC memory."""
+        memory = self._rtc.memory()
+        end = self._HEADER_SIZE + self._size
+        self._loaded = len(memory) == end + self._CRC_SIZE and \
+            ustruct.unpack(self._HEADER, memory) == (self._version,
+                                                     self._size) and \
+            ustruct.unpack_from('<I', memory, end)[0] == \
+            ubinascii.crc32(memory[:end]) & 0xffffffff
+        if self._loaded:
+            self._data = bytearray(memory[self._HEADER_SIZE:end])
+        else:
+            self._data = bytearray(self._size)
+        self._changed = False
+
+    def save(self):
+        """Write the record to RTC memory if it changed since load()."""
+        if self._loaded and not self._changed:
+            return
+        record = ustruct.pack(self._HEADER, self._version, self._size) + \
+            self._data
+        self._rtc.memory(record + ustruct.pack(
+            '<I', ubinascii.crc32(record) & 0xffffffff))
+        self._loaded = True
+        self._changed = False
+
+    def __getitem__(self, name):
+        offset, fmt = self._fields[name]
+        return ustruct.unpack_from(fmt, self._data, offset)[0]
+
+    def __setitem__(self, name, value):
+        offset, fmt = self._fields[name]
+        if ustruct.unpack_from(fmt, self._data, offset)[0] != value:
+            ustruct.pack_into(fmt, self._data, offset, value)
+            self._changed = True
@@ -0,0 +1,171 @@
+"""Benchmark of the bme280.BME280 compensation engines on the host.
+
+Compensates a grid of raw readings spanning the operating range (-40 to
+85C, 300 to 1100hPa, 0 to 100%RH) with the 64 bit reference and the 32 bit
+engine, and reports their time, the largest difference from the reference
+and how many intermediate values would be big ints on MicroPython (beyond
+31 bits, so allocated on the heap):
+
+    python tools/bench_bme280.py
+"""
+import random
+import struct
+import time
+
+import host
+
+host.install_machine()
+
+import bme280  # noqa: E402
+import i2c_bus  # noqa: E402
+
+# Largest small int of MicroPython on a 32 bit port
+SMALL_INT = (1 << 30) - 1
+
+# dig_T1 to dig_H6, the datasheet example for temperature and pressure
+DATASHEET = (27504, 26435, -1000, 36477, -10685, 3024, 2855, 140, -7, 15500,
+             -14600, 6000, 75, 362, 0, 313, 50, 30)
+# Calibrations are the datasheet's with each value varied by up to this
+VARIATION = 0.25
+CALIBRATIONS = 4
+STEPS = 24
+
+ENGINES = (('int64', bme280.BME280_COMPENSATION_INT64),
+           ('int32', bme280.BME280_COMPENSATION_INT32))
+
+
+def _bus(dig):
+    # Bus with a BME280 of the calibration, only its registers
+    t1, t2, t3, p1, p2, p3, p4, p5, p6, p7, p8, p9, h1, h2, h3, h4, h5, \
+        h6 = dig
+    registers = bytearray(256)
+    registers[0xD0] = bme280.BME280_CHIP_ID
+    registers[0x88:0x88 + 26] = struct.pack(
+        '<HhhHhhhhhhhhBB', t1, t2, t3, p1, p2, p3, p4, p5, p6, p7, p8, p9, 0,
+        h1)
+    registers[0xE1:0xE1 + 7] = struct.pack(
+        '<hBbBbb', h2, h3, h4 >> 4, (h4 & 0xf) | ((h5 & 0xf) << 4), h5 >> 4,
+        h6)
+    host.I2C.devices[bme280.BME280_I2CADDR] = registers
+    return i2c_bus.I2CBus(host.Pin(0), host.Pin(1))
+
+
+class _Audited(int):
+    # int recording the largest magnitude of the values computed from it
+
+    big = 0
+
+    def __new__(cls, value):
+        value = int.__new__(cls, value)
+        if abs(value) > SMALL_INT:
+            _Audited.big += 1
+        return value
+
+
+def _audited(name):
+    method = getattr(int, name)
+
+    def operation(self, *args):
+        value = method(self, *args)
+        return value if value is NotImplemented else _Audited(value)
+    return operation
+
+
+for _name in ('add', 'radd', 'sub', 'rsub', 'mul', 'rmul', 'floordiv',
+              'rfloordiv', 'lshift', 'rshift', 'and', 'neg'):
+    setattr(_Audited, '__%s__' % _name, _audited('__%s__' % _name))
+
+
+def calibrations():
+    rand = random.Random(280)
+    yield DATASHEET
+    for _ in range(CALIBRATIONS - 1):
+        dig = [round(value * (1 + rand.uniform(-VARIATION, VARIATION)))
+               for value in DATASHEET]
+        dig[14] = DATASHEET[14]  # dig_H3 is usually 0
+        yield tuple(dig)
+
+
+def _search(sensor, index, raw, target, low, high):
+    # Raw value giving the target compensated value with the reference
+    result = [0, 0, 0]
+    increasing = None
+    while high - low > 1:
+        middle = (low + high) // 2
+        raw[index] = middle
+        sensor.compensate(raw, result)
+        if increasing is None:
+            raw[index] = low
+            low_value = [0, 0, 0]
+            sensor.compensate(raw, low_value)
+            increasing = result[index] > low_value[index]
+        if (result[index] < target) == increasing:
+            low = middle
+        else:
+            high = middle
+    return low
+
+
+def readings(sensor):
+    # Raw readings spanning the operating range
+    raw = [0, 0, 0]
+    temps = []
+    for step in range(STEPS):
+        temp = -4000 + 12500 * step // (STEPS - 1)
+        temps.append(_search(sensor, 0, raw, temp, 0, 1 << 20))
+    result = []
+    for raw_temp in temps:
+        raw[0] = raw_temp
+        for step in range(STEPS):
+            pressure = (30000 + 80000 * step // (STEPS - 1)) * 256
+            raw_press = _search(sensor, 1, raw, pressure, 0, 1 << 20)
+            for humidity in range(0, 101, 100 // (STEPS - 1)):
+                raw_hum = _search(sensor, 2, raw, humidity * 1024, 0,
+                                  1 << 16)
+                result.append((raw_temp, raw_press, raw_hum))
+    return result
+
+
+def main():
+    print('%-6s %-6s %8s %8s %8s %8s %8s' % (
+        'calib', 'engine', 'us/call', 'max dT', 'max dP', 'max dH',
+        'big ints'))
+    for number, dig in enumerate(calibrations()):
+        sensors = [bme280.BME280(i2c=_bus(dig), compensation=engine)
+                   for _, engine in ENGINES]
+        raws = readings(sensors[0])
+        expected = []
+        for raw in raws:
+            result = [0, 0, 0]
+            sensors[0].compensate(raw, result)
+            expected.append(result)
+        for (name, engine), sensor in zip(ENGINES, sensors):
+            result = [0, 0, 0]
+            start = time.perf_counter()
+            for raw in raws:
+                sensor.compensate(raw, result)
+            elapsed = (time.perf_counter() - start) * 1000000 / len(raws)
+
+            worst = [0, 0, 0]
+            for raw, reference in zip(raws, expected):
+                sensor.compensate(raw, result)
+                for i in range(3):
+                    worst[i] = max(worst[i], abs(result[i] - reference[i]))
+
+            _Audited.big = 0
+            audited = bme280.BME280(i2c=_bus(dig), compensation=engine)
+            for attribute in dir(audited):
+                if attribute.startswith('dig_'):
+                    setattr(audited, attribute,
+                            _Audited(getattr(audited, attribute)))
+            for raw in raws:
+                audited.compensate([_Audited(value) for value in raw],
+                                   result)
+            print('%-6d %-6s %8.2f %8.2f %8.2f %8.3f %8d' % (
+                number, name, elapsed, worst[0] / 100, worst[1] / 256,
+                worst[2] / 1024, _Audited.big))
+    print('dT in C, dP in Pa, dH in %RH, big ints counted over',
+          len(raws), 'readings per calibration')
+
+
+main()
@@ -0,0 +1,76 @@
+"""Micro-benchmark of display_buffer.Buffer fills and lines on the host.
+
+Compares the current Buffer with the original pixel by pixel
+implementation in reference_buffer.py:
+
+    python tools/bench_buffer.py
+"""
+import os
+import time
+
+import host
+
+host.install()
+os.chdir(host.ROOT)
+
+import display_buffer  # noqa: E402
+import reference_buffer  # noqa: E402
+
+WIDTH = 128
+HEIGHT = 296
+REPEAT = 50
+
+
+def background(buf):
+    buf.background(buf.WHITE)
+
+
+def borders(buf):
+    # Screen._add_borders
+    buf.line(0, 64, 296, 64, buf.BLACK, buf.PEN_MEDIUM)
+    buf.line(148, 0, 148, 128, buf.BLACK, buf.PEN_MEDIUM)
+
+
+def voltage_box(buf):
+    # Screen._add_voltage
+    buf.line(272, 118, 272, 128, buf.BLACK, buf.PEN_THIN)
+    buf.line(272, 118, 296, 118, buf.BLACK, buf.PEN_THIN)
+
+
+def thick_lines(buf):
+    for y in range(10, 120, 20):
+        buf.line(10, y, 280, y, buf.BLACK, buf.PEN_THICK)
+    for x in range(10, 290, 40):
+        buf.line(x, 5, x, 120, buf.BLACK, buf.PEN_THICK)
+
+
+def diagonals(buf):
+    for pen in (buf.PEN_THIN, buf.PEN_MEDIUM, buf.PEN_THICK):
+        buf.line(0, 0, 295, 127, buf.BLACK, pen)
+        buf.line(0, 127, 295, 0, buf.BLACK, pen)
+        buf.line(100, -20, 180, 150, buf.BLACK, pen)
+
+
+def time_ms(buf, operation):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        operation(buf)
+    return (time.perf_counter() - start) * 1000 / REPEAT
+
+
+def main():
+    before = reference_buffer.Buffer(WIDTH, HEIGHT)
+    after = display_buffer.Buffer(WIDTH, HEIGHT)
+    print('%-12s %10s %10s %8s' % ('operation', 'before ms', 'after ms',
+                                   'speedup'))
+    for operation in (background, borders, voltage_box, thick_lines,
+                      diagonals):
+        old = time_ms(before, operation)
+        new = time_ms(after, operation)
+        print('%-12s %10.3f %10.3f %7.1fx' % (operation.__name__, old, new,
+                                               old / new))
+    if before.get() != after.get():
+        print('WARNING: buffers differ')
+
+
+main()
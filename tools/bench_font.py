@@ -0,0 +1,84 @@
+"""Compare the list based hershey.simplex with the compiled vector_font.
+
+Measures the time and heap needed to load each font and fetch the glyphs
+used by the screen. Runs on the host with the stand-ins in host.py (peak
+heap from tracemalloc), or on the esp32 (retained heap from gc.mem_alloc):
+copy this file and simplex.fnt to the board and run 'import bench_font'.
+"""
+import gc
+import sys
+import time
+
+if not hasattr(sys, 'implementation') or \
+        sys.implementation.name != 'micropython':
+    # time.ticks_us() and time.ticks_diff() from the stand-ins
+    import os
+    import tracemalloc
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import host
+    host.install()
+    os.chdir(host.ROOT)
+else:
+    tracemalloc = None
+
+SCREEN_TEXT = 'Temperature Humidity eCO2 ppm TVOC ppb 0123456789C%.VB'
+
+
+def _heap_start():
+    gc.collect()
+    if tracemalloc:
+        tracemalloc.start()
+        return 0
+    return gc.mem_alloc()
+
+
+def _heap_end(start):
+    if tracemalloc:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak
+    gc.collect()
+    return gc.mem_alloc() - start
+
+
+def _forget(name):
+    if name in sys.modules:
+        del sys.modules[name]
+
+
+def bench_list_font():
+    """Import hershey and index the screen glyphs."""
+    _forget('hershey')
+    heap = _heap_start()
+    start = time.ticks_us()
+    import hershey
+    for c in SCREEN_TEXT:
+        hershey.simplex[ord(c) - 32]
+    elapsed = time.ticks_diff(time.ticks_us(), start)
+    return elapsed, _heap_end(heap), hershey
+
+
+def bench_compiled_font():
+    """Open the compiled font and load the screen glyphs."""
+    _forget('vector_font')
+    heap = _heap_start()
+    start = time.ticks_us()
+    import vector_font
+    font = vector_font.Font()
+    for c in SCREEN_TEXT:
+        font.glyph(ord(c))
+    elapsed = time.ticks_diff(time.ticks_us(), start)
+    return elapsed, _heap_end(heap), font
+
+
+def main():
+    list_us, list_heap, hershey = bench_list_font()
+    del hershey
+    font_us, font_heap, font = bench_compiled_font()
+    font.close()
+    print('%-16s %10s %10s' % ('font', 'time us', 'heap bytes'))
+    print('%-16s %10d %10d' % ('hershey.simplex', list_us, list_heap))
+    print('%-16s %10d %10d' % ('vector_font', font_us, font_heap))
+
+
+main()
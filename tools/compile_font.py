@@ -0,0 +1,57 @@
+"""Compile the Hershey simplex font into a compact binary file.
+
+Run on the host, then copy the output file to the esp32 alongside the
+Python files, for example:
+
+    python tools/compile_font.py simplex.fnt
+
+File layout (see vector_font.Font):
+
+    'HF2'                 magic
+    first, count          uint8 code of first character, glyph count
+    crc                   uint32 little endian CRC32 of the rest of the
+                          file, keys what is rendered with the font
+    offsets[count + 1]    uint16 little endian, relative to glyph data
+    glyphs                per glyph: vertex count, width, then the
+                          x, y vertex pairs as int8 without padding
+"""
+import os
+import struct
+import sys
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import hershey  # noqa: E402
+
+MAGIC = b'HF2'
+FIRST_CHAR = 32
+
+
+def compile_font(glyphs, first=FIRST_CHAR):
+    """Return the compiled font file contents for a list based font."""
+    data = bytearray()
+    offsets = []
+    for glyph in glyphs:
+        vertex_count = glyph[0]
+        record = glyph[:2 + 2 * vertex_count]
+        offsets.append(len(data))
+        data.extend(struct.pack('<B%db' % (len(record) - 1), *record))
+    offsets.append(len(data))
+    body = struct.pack('<%dH' % len(offsets), *offsets) + bytes(data)
+    header = MAGIC + struct.pack('<BBI', first, len(glyphs),
+                                 zlib.crc32(body))
+    return header + body
+
+
+def main(argv):
+    output = argv[1] if len(argv) > 1 else 'simplex.fnt'
+    compiled = compile_font(hershey.simplex)
+    with open(output, 'wb') as font_file:
+        font_file.write(compiled)
+    print('%s: %d glyphs, %d bytes' % (output, len(hershey.simplex),
+                                       len(compiled)))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,92 @@
+"""Golden frame comparison of display_buffer.Buffer on the host.
+
+Renders the same frames with the current Buffer and with the original
+pixel by pixel implementation in reference_buffer.py and checks they are
+identical byte for byte:
+
+    python tools/golden_frames.py [frames]
+
+Frames cover every pen and colour, lines clipped by each edge of the
+display and the screen text at each of its sizes, both stroked and
+blitted from a glyph_cache.GlyphCache.
+"""
+import os
+import random
+import sys
+
+import host
+
+host.install()
+os.chdir(host.ROOT)
+
+import display_buffer  # noqa: E402
+import glyph_cache  # noqa: E402
+import reference_buffer  # noqa: E402
+
+WIDTH = 128
+HEIGHT = 296
+SCALES = (0.3, 0.6, 1.0, 1.5)
+TEXT = ('Temperature', 'Humidity', 'eCO2 ppm', 'TVOC ppb', '-12C', '100%',
+        '32768', '4.1V', 'B', 'jpqgy[_]')
+
+
+def lines_frame(rnd, buf):
+    buf.background(rnd.choice((buf.WHITE, buf.BLACK)))
+    for _ in range(20):
+        # Mostly diagonal, some axis aligned and some off the display
+        x = rnd.randint(-20, HEIGHT + 20)
+        y = rnd.randint(-20, WIDTH + 20)
+        x2 = rnd.choice((x, rnd.randint(-20, HEIGHT + 20)))
+        y2 = rnd.choice((y, rnd.randint(-20, WIDTH + 20)))
+        buf.line(x, y, x2, y2, rnd.choice((buf.WHITE, buf.BLACK)),
+                 rnd.choice((buf.PEN_THIN, buf.PEN_MEDIUM, buf.PEN_THICK)))
+
+
+def text_frame(rnd, buf):
+    buf.background(buf.WHITE)
+    for _ in range(4):
+        scale = rnd.choice(SCALES)
+        buf.write_text(rnd.choice(TEXT), rnd.randint(-10, HEIGHT - 20),
+                       rnd.randint(-10, WIDTH - 10), buf.BLACK, scale, scale,
+                       None, rnd.choice((buf.PEN_THIN, buf.PEN_MEDIUM,
+                                         buf.PEN_THICK)))
+
+
+def screen_frame(rnd, buf):
+    # Layout drawn by screen.Screen
+    buf.background(buf.WHITE)
+    buf.line(0, 64, HEIGHT, 64, buf.BLACK, buf.PEN_MEDIUM)
+    buf.line(148, 0, 148, WIDTH, buf.BLACK, buf.PEN_MEDIUM)
+    buf.line(272, 118, 272, WIDTH, buf.BLACK, buf.PEN_THIN)
+    buf.line(272, 118, HEIGHT, 118, buf.BLACK, buf.PEN_THIN)
+    for text, x, y in (('Temperature', 2, 113), ('Humidity', 152, 113),
+                       ('eCO2 ppm', 2, 48), ('TVOC ppb', 152, 48)):
+        buf.write_text(text, x, y, buf.BLACK, 0.6, 0.6, None, buf.PEN_MEDIUM)
+    for text, x, y in (('%dC' % rnd.randint(-9, 40), 5, 70),
+                       ('%d%%' % rnd.randint(0, 100), 158, 70),
+                       ('%d' % rnd.randint(400, 32768), 10, 5),
+                       ('%d' % rnd.randint(0, 32768), 158, 5)):
+        buf.write_text(text, x, y, buf.BLACK, 1.5, 1.5, None, buf.PEN_MEDIUM)
+    buf.write_text('%.1fV' % (rnd.randint(30, 42) / 10), 274, 120, buf.BLACK,
+                   0.3, 0.3, None, buf.PEN_THIN)
+
+
+def main(argv):
+    frames = int(argv[1]) if len(argv) > 1 else 300
+    failures = 0
+    cache = glyph_cache.GlyphCache(None)
+    for frame in range(frames):
+        draw = (lines_frame, text_frame, screen_frame)[frame % 3]
+        golden = reference_buffer.Buffer(WIDTH, HEIGHT)
+        draw(random.Random(frame), golden)
+        actual = display_buffer.Buffer(WIDTH, HEIGHT,
+                                       cache=cache if frame % 2 else None)
+        draw(random.Random(frame), actual)
+        if golden.get() != actual.get():
+            failures += 1
+            print('frame %d (%s) differs' % (frame, draw.__name__))
+    print('%d of %d frames identical' % (frames - failures, frames))
+    return 1 if failures else 0
+
+
+sys.exit(main(sys.argv))
@@ -0,0 +1,325 @@
+"""Stand-ins for MicroPython modules so device code can run on the host.
+
+Call install() before importing modules from the repository root, and
+install_machine() as well for modules that use the hardware. The stand-in
+SPI bus writes to a Panel emulating the e-paper display controller RAM, so
+screen.Screen renders into memory and frames can be exported with
+write_pbm() or write_png().
+"""
+import os
+import struct
+import sys
+import time
+import types
+import zlib
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# e-paper display, the frame is stored a panel row (128 pixels) at a time
+EPD_WIDTH = 128
+EPD_HEIGHT = 296
+
+
+def _ustruct():
+    module = types.ModuleType('ustruct')
+    module.pack = struct.pack
+    module.pack_into = struct.pack_into
+    module.calcsize = struct.calcsize
+    module.unpack_from = struct.unpack_from
+
+    def unpack(fmt, data):
+        # MicroPython ignores data beyond the format
+        return struct.unpack_from(fmt, data)
+
+    module.unpack = unpack
+    return module
+
+
+def _micropython():
+    module = types.ModuleType('micropython')
+    module.const = lambda value: value
+    return module
+
+
+def install():
+    """Install the stand-in modules and put the repository on the path.
+
+    The MicroPython only functions of utime are also added to time, which
+    device modules and the tools measuring them import as well.
+    """
+    import binascii
+    import io
+    sys.modules.setdefault('ustruct', _ustruct())
+    sys.modules.setdefault('micropython', _micropython())
+    sys.modules.setdefault('uio', io)
+    sys.modules.setdefault('uos', os)
+    sys.modules.setdefault('ubinascii', binascii)
+    utime = sys.modules.setdefault('utime', _utime())
+    for name in ('sleep_ms', 'sleep_us', 'ticks_ms', 'ticks_us',
+                 'ticks_diff'):
+        if not hasattr(time, name):
+            setattr(time, name, getattr(utime, name))
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+
+class Pin:
+    """Stand-in machine.Pin, Pins with the same id share their value."""
+
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 2
+    IRQ_RISING = 1
+    WAKE_LOW = 4
+    WAKE_HIGH = 5
+
+    _values = {}
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self.init(mode, pull, value=value)
+
+    def init(self, mode=-1, pull=-1, value=None):
+        if value is not None:
+            Pin._values[self.id] = value
+        elif pull == self.PULL_UP:
+            # Pulled up inputs read high, as the switches are not pressed
+            Pin._values[self.id] = 1
+
+    def value(self, value=None):
+        if value is None:
+            return Pin._values.get(self.id, 0)
+        Pin._values[self.id] = value
+
+    __call__ = value
+
+    def irq(self, handler=None, trigger=IRQ_FALLING, wake=None):
+        return None
+
+
+class Panel:
+    """Display controller RAM written through the stand-in SPI bus.
+
+    Decodes the RAM window, address counter and RAM write commands of the
+    IL3820 controller, with X and Y incrementing, as sent by epaper2in9.
+    The controller has two RAM banks, writes go to one and a refresh shows
+    it then switches writes to the other. ram is the frame last shown.
+    dc is the data/command Pin, None for the one in the repository config.
+    """
+
+    def __init__(self, dc=None):
+        self.dc = dc
+        self.ram = bytearray(EPD_WIDTH // 8 * EPD_HEIGHT)
+        self.banks = (bytearray(len(self.ram)), bytearray(len(self.ram)))
+        self.bank = 0  # written
+        self.refreshes = 0
+        self._command = None
+        self._args = bytearray()
+        self._x_start = 0
+        self._x_end = EPD_WIDTH // 8 - 1
+        self._y_start = 0
+        self._y_end = EPD_HEIGHT - 1
+        self._x = 0
+        self._y = 0
+
+    def write(self, data):
+        if self.dc is None:
+            import config
+            self.dc = Pin(config.dc)
+        if not self.dc.value():
+            for command in bytes(data):
+                self._set_command(command)
+            return
+        if self._command == 0x24:
+            for byte in bytes(data):
+                self._write_ram(byte)
+            return
+        self._args.extend(data)
+        args = self._args
+        if self._command == 0x44 and len(args) == 2:
+            self._x_start, self._x_end = args[0], args[1]
+        elif self._command == 0x45 and len(args) == 4:
+            self._y_start, self._y_end = struct.unpack('<HH', args)
+        elif self._command == 0x4E and len(args) == 1:
+            self._x = args[0]
+        elif self._command == 0x4F and len(args) == 2:
+            self._y = struct.unpack('<H', args)[0]
+
+    def _set_command(self, command):
+        self._command = command
+        self._args = bytearray()
+        if command == 0x20:
+            self.refreshes += 1
+            self.ram[:] = self.banks[self.bank]
+            self.bank ^= 1
+
+    def _write_ram(self, byte):
+        self.banks[self.bank][self._y * EPD_WIDTH // 8 + self._x] = byte
+        self._x += 1
+        if self._x > self._x_end:
+            self._x = self._x_start
+            self._y += 1
+            if self._y > self._y_end:
+                self._y = self._y_start
+
+
+class SPI:
+    """Stand-in machine.SPI, everything written goes to SPI.panel."""
+
+    panel = Panel()
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def init(self, *args, **kwargs):
+        pass
+
+    def write(self, data):
+        SPI.panel.write(data)
+
+
+class RTC:
+    """Stand-in machine.RTC, memory is kept for the life of the process."""
+
+    _memory = b''
+
+    def memory(self, data=None):
+        if data is None:
+            return RTC._memory
+        RTC._memory = bytes(data)
+
+
+class ADC:
+    """Stand-in machine.ADC, reading mid scale."""
+
+    ATTN_0DB = 0
+    ATTN_11DB = 3
+
+    def __init__(self, pin):
+        pass
+
+    def atten(self, attenuation):
+        pass
+
+    def read(self):
+        return 2048
+
+
+class I2C:
+    """Stand-in machine.I2C, devices maps addresses to their registers.
+
+    There are no devices unless a tool adds a bytearray of 256 registers.
+    """
+
+    devices = {}
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def init(self, *args, **kwargs):
+        pass
+
+    def scan(self):
+        return sorted(self.devices)
+
+    def _registers(self, address):
+        if address not in self.devices:
+            raise OSError(19)  # ENODEV
+        return self.devices[address]
+
+    def readfrom_mem_into(self, address, register, buf):
+        buf[:] = self._registers(address)[register:register + len(buf)]
+
+    def readfrom_mem(self, address, register, size):
+        return bytes(self._registers(address)[register:register + size])
+
+    def writeto_mem(self, address, register, data):
+        self._registers(address)[register:register + len(data)] = data
+
+    def writeto(self, address, data):
+        self._registers(address)
+
+    def readfrom_into(self, address, buf):
+        self._registers(address)
+
+
+def _machine():
+    module = types.ModuleType('machine')
+    module.Pin = Pin
+    module.SPI = SPI
+    module.RTC = RTC
+    module.ADC = ADC
+    module.I2C = I2C
+    module.SLEEP = 2
+    module.DEEPSLEEP = 4
+    module.idle = lambda: None
+    module.lightsleep = lambda ms=None: None
+    module.deepsleep = lambda ms=None: None
+    return module
+
+
+def _utime():
+    module = types.ModuleType('utime')
+    module.sleep = time.sleep
+    # Nothing to wait for on the host
+    module.sleep_ms = lambda ms: None
+    module.sleep_us = lambda us: None
+    module.ticks_ms = lambda: int(time.perf_counter() * 1000)
+    module.ticks_us = lambda: int(time.perf_counter() * 1000000)
+    module.ticks_diff = lambda end, start: end - start
+    module.time = lambda: int(time.time())
+    module.localtime = time.localtime
+    return module
+
+
+def install_machine():
+    """Install the stand-in machine module as well as the others.
+
+    Returns the Panel the stand-in SPI bus writes to.
+    """
+    install()
+    sys.modules.setdefault('machine', _machine())
+    return SPI.panel
+
+
+def _rows(frame):
+    # Rows of the frame as shown with the display landscape, its bottom
+    # edge the buffer y 0, each row WIDTH bits with 1 for black
+    stride = EPD_WIDTH // 8
+    for y in range(EPD_WIDTH - 1, -1, -1):
+        offset = y >> 3
+        mask = 0x80 >> (y & 7)
+        row = bytearray(EPD_HEIGHT // 8 + (1 if EPD_HEIGHT % 8 else 0))
+        for x in range(EPD_HEIGHT):
+            if not frame[x * stride + offset] & mask:
+                row[x >> 3] |= 0x80 >> (x & 7)
+        yield bytes(row)
+
+
+def write_pbm(frame, filename):
+    """Write a frame in display buffer layout as a binary PBM image."""
+    with open(filename, 'wb') as image:
+        image.write(b'P4\n%d %d\n' % (EPD_HEIGHT, EPD_WIDTH))
+        for row in _rows(frame):
+            image.write(row)
+
+
+def write_png(frame, filename):
+    """Write a frame in display buffer layout as a 1 bit PNG image."""
+    # PNG grey levels are the other way round to PBM, 1 is white
+    raw = b''.join(b'\x00' + bytes(~byte & 0xff for byte in row)
+                   for row in _rows(frame))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + \
+            struct.pack('>I', zlib.crc32(kind + data))
+
+    with open(filename, 'wb') as image:
+        image.write(b'\x89PNG\r\n\x1a\n')
+        image.write(chunk(b'IHDR', struct.pack('>IIBBBBB', EPD_HEIGHT,
+                                               EPD_WIDTH, 1, 0, 0, 0, 0)))
+        image.write(chunk(b'IDAT', zlib.compress(raw)))
+        image.write(chunk(b'IEND', b''))
@@ -0,0 +1,74 @@
+"""Report the time and heap each module of the wake path costs to import.
+
+Modules are imported in dependency order, so each is charged only for
+itself, and grouped by the wakes that need them. Runs on the host with the
+stand-ins in host.py (heap from tracemalloc), or on the esp32 after a
+reset (heap from gc.mem_alloc): copy this file to the board and run
+'import import_report'.
+"""
+import gc
+import sys
+import time
+
+if not hasattr(sys, 'implementation') or \
+        sys.implementation.name != 'micropython':
+    # time.ticks_us() and time.ticks_diff() from the stand-ins
+    import os
+    import tracemalloc
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import host
+    host.install_machine()
+    os.chdir(host.ROOT)
+else:
+    tracemalloc = None
+
+# (wakes needing them, modules)
+GROUPS = (('every wake', ('config', 'i2c_bus', 'ccs811', 'bme280',
+                          'battery', 'reading_log', 'refresh', 'rollup',
+                          'screen_texts', 'state', 'trend',
+                          'air_quality')),
+          ('baseline changes', ('baseline',)),
+          ('display updates', ('vector_font', 'glyph_cache',
+                               'display_buffer', 'epaper2in9', 'screen')))
+
+
+def _import(name):
+    # Time and retained heap of importing name, None if already imported
+    if name in sys.modules:
+        return None
+    gc.collect()
+    if tracemalloc:
+        tracemalloc.start()
+    else:
+        heap = gc.mem_alloc()
+    start = time.ticks_us()
+    __import__(name)
+    elapsed = time.ticks_diff(time.ticks_us(), start)
+    gc.collect()
+    if tracemalloc:
+        heap = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    else:
+        heap = gc.mem_alloc() - heap
+    return elapsed, heap
+
+
+def main():
+    print('%-18s %-16s %10s %10s' % ('wakes', 'module', 'time us',
+                                     'heap bytes'))
+    for wakes, names in GROUPS:
+        total_us = 0
+        total_heap = 0
+        for name in names:
+            cost = _import(name)
+            if cost is None:
+                print('%-18s %-16s %21s' % (wakes, name, 'already imported'))
+                continue
+            print('%-18s %-16s %10d %10d' % ((wakes, name) + cost))
+            total_us += cost[0]
+            total_heap += cost[1]
+        print('%-18s %-16s %10d %10d' % (wakes, 'total', total_us,
+                                         total_heap))
+
+
+main()
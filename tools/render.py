@@ -0,0 +1,115 @@
+"""Render screen.Screen frames on the host and export them as images.
+
+Each line of the readings file is one update of the screen, with the
+temperature, humidity, eCO2, TVOC, battery voltage and baseline loaded
+flag separated by commas, an empty value for no reading:
+
+    21.5,45,,,4.1,0
+    21.6,45,412,3,4.1,1
+
+The first update is a full update, the rest partial updates as on the
+device. Each frame is read back from the emulated display memory, so
+partial updates are checked as well as the layout, and any frame that
+differs from the one Screen rendered is reported:
+
+    python tools/render.py [readings] [--out DIR] [--png] [--trend]
+
+Frames are written to DIR (default frames) with the glyph cache and screen
+template kept there, and the render time of each frame is reported. With
+--trend the eCO2 of each reading is added to the trend graph, one reading
+for each config.trend_period.
+"""
+import argparse
+import os
+import shutil
+import sys
+import time
+
+import host
+
+SAMPLE = ((21.2, 45.1, None, None, 4.11, False),
+          (21.4, 45.3, None, None, 4.11, False),
+          (22.6, 45.3, 410, 3, 4.1, False),
+          (22.6, 47.8, 1234, 567, 4.04, True),
+          (-9, 100, 32768, 32768, None, True))
+
+
+def parse(line):
+    """Reading tuple from a line of the readings file."""
+    values = [value.strip() for value in line.split(',')]
+    values += [''] * (6 - len(values))
+    temperature, humidity, co2, voc, voltage, baseline = values[:6]
+    return (float(temperature), float(humidity),
+            int(co2) if co2 else None, int(voc) if voc else None,
+            float(voltage) if voltage else None,
+            baseline not in ('', '0', 'False', 'false'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('readings', nargs='?',
+                        help='readings file, a built in sample if omitted')
+    parser.add_argument('--out', default='frames',
+                        help='directory for the frames')
+    parser.add_argument('--png', action='store_true',
+                        help='write PNG rather than PBM images')
+    parser.add_argument('--trend', action='store_true',
+                        help='graph the eCO2 trend')
+    args = parser.parse_args()
+
+    if args.readings:
+        with open(args.readings) as readings_file:
+            readings = [parse(line) for line in readings_file
+                        if line.strip() and not line.startswith('#')]
+    else:
+        readings = SAMPLE
+
+    os.makedirs(args.out, exist_ok=True)
+    shutil.copy(os.path.join(host.ROOT, 'simplex.fnt'), args.out)
+    panel = host.install_machine()
+    os.chdir(args.out)
+
+    import config
+    import screen
+    import trend
+
+    graph = None
+    if args.trend:
+        # 144 columns as on the device
+        graph = trend.Trend(144, config.trend_period, config.trend_range[0],
+                            config.trend_range[1])
+    shown = None
+    epd_state = 0
+    total = 0
+    differing = 0
+    for frame, reading in enumerate(readings):
+        start = time.perf_counter()
+        if graph is not None and reading[2] is not None:
+            graph.add((frame + 1) * config.trend_period, reading[2])
+        scr = screen.Screen(config, shown, epd_state)
+        scr.update(*reading, fullupdate=frame == 0, trend=graph)
+        scr.sleep()
+        elapsed = time.perf_counter() - start
+        total += elapsed
+        shown = scr.shown
+        epd_state = scr.epd_state
+        name = 'frame%03d.%s' % (frame, 'png' if args.png else 'pbm')
+        if args.png:
+            host.write_png(panel.ram, name)
+        else:
+            host.write_pbm(panel.ram, name)
+        print('%s %7.1fms %5d bytes %2d transactions  %r' %
+              (name, elapsed * 1000, scr.bytes_sent, scr.transactions,
+               reading))
+        if panel.ram != scr.frame:
+            # Partial updates missed a change
+            differing += 1
+            print('%s differs from the rendered frame' % name)
+    print('%d frames, %.1fms per frame' %
+          (len(readings), total * 1000 / max(len(readings), 1)))
+    if differing:
+        print('%d frames differ from the rendered frames' % differing)
+        sys.exit(1)
+
+
+main()
@@ -0,0 +1,130 @@
+"""Trend of a reading, a column of a graph for each period."""
+import ustruct
+
+
+class Trend:
+    """Trend of a reading, a column of a graph for each period.
+
+    The reading of each period kept is the one Largest Triangle Three
+    Buckets (LTTB) downsampling selects, so peaks are shown rather than
+    averaged away. A column is selected once the period after it ends, the
+    third point being that period's mean. The columns are a ring, the
+    newest followed by a blank column, so adding one changes only three
+    columns of the graph. The state, including the columns, is bytes that
+    can be held in RTC memory during deep sleep.
+    """
+
+    LEVELS = 255  # column levels are 1 to LEVELS, 0 when there is no value
+
+    # Open period, its minimum, maximum, sum and count, the closed period,
+    # its minimum, maximum and mean, the period and value last selected,
+    # the newest column's period and the newest drawn. Periods are counted
+    # from the epoch, 0 for none.
+    _STATE = '<IHHIHIHHHIHII'
+    _STATE_SIZE = 38
+
+    def __init__(self, columns, period, low, high, state=None):
+        """Create for columns of period seconds.
+
+        low and high are the values at the bottom and top of the graph.
+        state is bytes from the state property of a previous wake, None if
+        not known.
+        """
+        self.columns = columns
+        self.period = period
+        self._low = low
+        self._high = high
+        self._state = bytearray(self.state_size(columns))
+        if state is not None and len(state) == len(self._state):
+            self._state[:] = state
+        self._fields = list(ustruct.unpack_from(self._STATE, self._state))
+        self._levels = memoryview(self._state)[self._STATE_SIZE:]
+
+    @classmethod
+    def state_size(cls, columns):
+        """Size of the state for a graph of columns."""
+        return cls._STATE_SIZE + columns
+
+    @property
+    def state(self):
+        """State to pass to the next Trend, as bytes."""
+        ustruct.pack_into(self._STATE, self._state, 0, *self._fields)
+        return bytes(self._state)
+
+    def add(self, timestamp, value):
+        """Add a reading at timestamp, as from utime.time()."""
+        state = self._fields
+        index = timestamp // self.period
+        if index != state[0]:
+            if state[4]:
+                self._close()
+            state[0:5] = [index, value, value, 0, 0]
+        if value < state[1]:
+            state[1] = value
+        if value > state[2]:
+            state[2] = value
+        state[3] += value
+        state[4] += 1
+
+    def level(self, column):
+        """Level of column, 0 if it has no value."""
+        return self._levels[column]
+
+    def changed(self):
+        """Columns changed since drawn(), oldest first."""
+        newest = self._fields[11]
+        drawn = self._fields[12]
+        if drawn >= newest:
+            return ()
+        # Up to the new blank column and the one after it, which is no
+        # longer joined to the column before it
+        return [i % self.columns
+                for i in range(max(drawn + 1, newest + 3 - self.columns),
+                               newest + 3)]
+
+    def drawn(self):
+        """Record the columns are shown on the display."""
+        self._fields[12] = self._fields[11]
+
+    def _close(self):
+        # The open period ends, select the closed period's value with the
+        # open period's mean as the third point
+        state = self._fields
+        mean = state[3] // state[4]
+        if state[5]:
+            self._select(state[0], mean)
+        state[5:9] = [state[0], state[1], state[2], mean]
+
+    def _select(self, index, mean):
+        # The points of a period share the x of its column, so the largest
+        # triangle has either the period's minimum or its maximum
+        state = self._fields
+        closed, low, high = state[5:8]
+        previous, value = state[9:11]
+        index = min(index, closed + self.columns)
+        if previous and closed - previous < self.columns:
+            # Twice the area of the triangle, x in periods
+            dx = previous - index
+            area_low = abs(dx * (low - value) -
+                           (previous - closed) * (mean - value))
+            area_high = abs(dx * (high - value) -
+                            (previous - closed) * (mean - value))
+            selected = high if area_high >= area_low else low
+        else:
+            # First point, the one furthest from the next
+            selected = high if high - mean >= mean - low else low
+        state[9:11] = [closed, selected]
+        self._set_column(closed, selected)
+
+    def _set_column(self, index, value):
+        state = self._fields
+        columns = self.columns
+        # Blank the columns of periods without a value since the newest
+        for i in range(max(state[11] + 1, index - columns + 1), index):
+            self._levels[i % columns] = 0
+        value = min(max(value, self._low), self._high)
+        self._levels[index % columns] = 1 + (value - self._low) * \
+            (self.LEVELS - 1) // (self._high - self._low)
+        self._levels[(index + 1) % columns] = 0
+        if index > state[11]:
+            state[11] = index
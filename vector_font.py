@@ -0,0 +1,51 @@
+"""Compiled Hershey vector font with glyphs loaded on demand.
+
+The font file is generated from hershey.py by tools/compile_font.py.
+"""
+import ustruct
+
+
+class Font:
+    """Compiled Hershey vector font with glyphs loaded on demand.
+
+    Only the offset index is read on construction, each glyph is read from
+    the file the first time it is needed. A glyph is returned in the same
+    layout as the hershey.simplex lists; vertex count, width, then x, y
+    pairs, as signed bytes with the padding removed.
+    """
+
+    _MAGIC = b'HF2'
+    _HEADER_SIZE = 9
+
+    def __init__(self, filename='simplex.fnt'):
+        """Open the compiled font file and read its index."""
+        self._file = open(filename, 'rb')
+        header = self._file.read(self._HEADER_SIZE)
+        if header[:3] != self._MAGIC:
+            raise ValueError('Not a compiled font: %s' % filename)
+        self._first = header[3]
+        self._count = header[4]
+        self.crc = ustruct.unpack_from('<I', header, 5)[0]
+        self._index = self._file.read(2 * (self._count + 1))
+        self._data_start = self._HEADER_SIZE + len(self._index)
+        self._glyphs = {}
+
+    def glyph(self, code):
+        """Return the glyph for a character code, None if not in the font."""
+        glyph = self._glyphs.get(code)
+        if glyph is None:
+            i = code - self._first
+            if i < 0 or i >= self._count:
+                return None
+            index = self._index
+            start = index[2 * i] | (index[2 * i + 1] << 8)
+            end = index[2 * i + 2] | (index[2 * i + 3] << 8)
+            self._file.seek(self._data_start + start)
+            glyph = self._file.read(end - start)
+            self._glyphs[code] = glyph
+        return glyph
+
+    def close(self):
+        """Close the font file."""
+        self._file.close()
+